@@ -0,0 +1,38 @@
+from django.db import models
+from natural_keys import NaturalKeyModel
+
+# Natural keys nested 1-4 levels deep
+
+
+class Region(NaturalKeyModel):
+    code = models.CharField(max_length=10, unique=True)
+
+
+class Site(NaturalKeyModel):
+    region = models.ForeignKey(Region, on_delete=models.CASCADE)
+    code = models.CharField(max_length=10)
+
+    class Meta:
+        unique_together = ["region", "code"]
+
+
+class Plot(NaturalKeyModel):
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    code = models.CharField(max_length=10)
+
+    class Meta:
+        unique_together = ["site", "code"]
+
+
+class Sample(NaturalKeyModel):
+    plot = models.ForeignKey(Plot, on_delete=models.CASCADE)
+    code = models.CharField(max_length=10)
+    date = models.DateField()
+
+    class Meta:
+        unique_together = ["plot", "code", "date"]
+
+
+class Observation(models.Model):
+    sample = models.ForeignKey(Sample, on_delete=models.CASCADE)
+    value = models.FloatField()
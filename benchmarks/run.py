@@ -0,0 +1,436 @@
+"""
+Benchmarks for natural key lookup, creation, and serialization, using an
+in-memory SQLite database.
+
+    python -m benchmarks.run            # Run and compare to baseline.json
+    python -m benchmarks.run --full     # Also run the 100k key benchmarks
+    python -m benchmarks.run --save     # Add new results to baseline.json
+    python -m benchmarks.run --save-all # Replace all saved results
+    python -m benchmarks.run --check    # Exit with an error on regressions
+
+Query counts are deterministic, so any increase is reported as a
+regression (and fails --check).  Timings depend on the machine and vary
+between runs, so large slowdowns (see --tolerance) are only reported for
+information.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from natural_keys import cache_natural_keys  # noqa: E402
+from benchmarks.bench_app.models import (  # noqa: E402
+    Region,
+    Site,
+    Plot,
+    Sample,
+    Observation,
+)
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+LOOKUPS = 200
+START_DATE = date(2020, 1, 1)
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def measure(name, ops, func, repeat=3):
+    """
+    Run func (in a transaction that is rolled back) and return the query
+    count and throughput, using the fastest of several runs.
+    """
+    best = None
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    for i in range(repeat):
+        with transaction.atomic():
+            with connection.execute_wrapper(count_query):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        if i == 0:
+            count = len(queries)
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "name": name,
+        "ops": ops,
+        "queries_per_op": round(count / ops, 4),
+        "ops_per_sec": round(ops / best, 1),
+    }
+
+
+def populate(samples_per_plot):
+    """
+    Create 10 regions x 10 sites x 10 plots x samples_per_plot samples, and
+    one observation per sample in the first region.
+    """
+    regions = Region.objects.bulk_create(
+        Region(code="r%s" % i) for i in range(10)
+    )
+    sites = Site.objects.bulk_create(
+        Site(region=region, code="s%s" % i)
+        for region in regions
+        for i in range(10)
+    )
+    plots = Plot.objects.bulk_create(
+        Plot(site=site, code="p%s" % i) for site in sites for i in range(10)
+    )
+    samples = Sample.objects.bulk_create(
+        (
+            Sample(
+                plot=plot,
+                code="x%s" % (i % 10),
+                date=START_DATE + timedelta(days=i // 10),
+            )
+            for plot in plots
+            for i in range(samples_per_plot)
+        ),
+        batch_size=5000,
+    )
+    Observation.objects.bulk_create(
+        Observation(sample=sample, value=i)
+        for i, sample in enumerate(samples)
+        if sample.plot.site.region_id == regions[0].pk
+    )
+
+
+def sample_keys(model, count):
+    """
+    Return count distinct natural keys for the model, in random order.
+    """
+    keys = list(model.objects.natural_keys())
+    random.shuffle(keys)
+    return keys[:count]
+
+
+def choose_keys(model, count):
+    """
+    Return count natural keys for the model, with repeats if needed.
+    """
+    return random.choices(list(model.objects.natural_keys()), k=count)
+
+
+@benchmark
+def get_by_natural_key(options):
+    for depth, model in enumerate([Region, Site, Plot, Sample], start=1):
+        keys = choose_keys(model, LOOKUPS)
+        yield measure(
+            "get_by_natural_key[depth=%s]" % depth,
+            len(keys),
+            lambda: [model.objects.get_by_natural_key(*key) for key in keys],
+        )
+
+
+@benchmark
+def resolve_keys(options):
+    keys = sample_keys(Sample, 1000)
+    yield measure(
+        "resolve_keys[1000]",
+        len(keys),
+        lambda: Sample.objects.resolve_keys(keys),
+        repeat=1,
+    )
+    sizes = [1000, 10000]
+    if options.full:
+        sizes.append(100000)
+    for size in sizes:
+        keys = sample_keys(Sample, size)
+        yield measure(
+            "resolve_keys[bulk,%s]" % size,
+            len(keys),
+            lambda: Sample.objects.resolve_keys(keys, bulk=True),
+        )
+
+
+@benchmark
+def natural_key_pks(options):
+    keys = sample_keys(Sample, 10000)
+    missing = [key[:-1] + (date(1999, 1, 1),) for key in keys[:1000]]
+    yield measure(
+        "natural_key_pks[10000]",
+        len(keys),
+        lambda: Sample.objects.natural_key_pks(keys),
+    )
+    yield measure(
+        "missing_natural_keys[10000]",
+        len(keys),
+        lambda: Sample.objects.missing_natural_keys(keys[1000:] + missing),
+    )
+    count = Sample.objects.count()
+    yield measure(
+        "natural_key_map[%s]" % count,
+        count,
+        lambda: Sample.objects.natural_key_map(),
+    )
+    yield measure(
+        "natural_key_map[intern,%s]" % count,
+        count,
+        lambda: Sample.objects.natural_key_map(intern=True),
+    )
+
+
+@benchmark
+def find(options):
+    keys = sample_keys(Sample, LOOKUPS)
+    yield measure(
+        "find[warm]",
+        len(keys),
+        lambda: [Sample.objects.find(*key) for key in keys],
+    )
+
+    def find_cached():
+        with cache_natural_keys():
+            for i in range(2):
+                for key in keys:
+                    Sample.objects.find(*key)
+
+    yield measure("find[cached]", len(keys) * 2, find_cached)
+
+    new_keys = [key[:-1] + (date(1999, 1, 1),) for key in keys]
+    yield measure(
+        "find[cold]",
+        len(new_keys),
+        lambda: [Sample.objects.find(*key) for key in new_keys],
+    )
+
+
+@benchmark
+def slug_filter(options):
+    slugs = [
+        "-".join(str(value) for value in key)
+        for key in sample_keys(Sample, LOOKUPS)
+    ]
+    yield measure(
+        "filter[natural_key_slug]",
+        len(slugs),
+        lambda: [Sample.objects.get(natural_key_slug=slug) for slug in slugs],
+    )
+
+    keys = sample_keys(Sample, 1000)
+    slugs = ["-".join(str(value) for value in key) for key in keys]
+    yield measure(
+        "filter[natural_key_slug__in]",
+        len(slugs),
+        lambda: list(Sample.objects.filter(natural_key_slug__in=slugs)),
+    )
+    yield measure(
+        "filter_natural_keys[1000]",
+        len(keys),
+        lambda: list(Sample.objects.filter_natural_keys(keys)),
+    )
+
+
+@benchmark
+def serializer(options):
+    try:
+        from natural_keys import NaturalKeyModelSerializer
+    except ImportError:
+        return
+    if NaturalKeyModelSerializer is None:
+        return
+
+    class ObservationSerializer(NaturalKeyModelSerializer):
+        class Meta:
+            model = Observation
+            fields = "__all__"
+            bulk_create = True
+
+    data = [
+        {
+            "sample": {
+                "plot": {
+                    "site": {"region": {"code": key[0]}, "code": key[1]},
+                    "code": key[2],
+                },
+                "code": key[3],
+                "date": str(key[4]),
+            },
+            "value": i,
+        }
+        for i, key in enumerate(sample_keys(Sample, 500))
+    ]
+
+    def list_create():
+        serializer = ObservationSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    yield measure("serializer[list_create]", len(data), list_create)
+
+    def list_read():
+        queryset = Observation.objects.select_related(
+            "sample__plot__site__region"
+        )[:500]
+        return ObservationSerializer(queryset, many=True).data
+
+    yield measure("serializer[list_read]", 500, list_read)
+
+
+def load_baseline(mode):
+    """
+    Load saved results for the given mode ("quick" or "full"), since the
+    full benchmarks use a larger dataset.
+    """
+    if not os.path.exists(BASELINE):
+        return {}
+    with open(BASELINE) as f:
+        return json.load(f)["results"].get(mode, {})
+
+
+def save_baseline(mode, results, replace=False):
+    """
+    Save results for the given mode.  Unless replace is True, only new
+    benchmarks (and those whose query counts changed) are saved, so that
+    the timings of unrelated benchmarks are kept.
+    """
+    saved = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            saved = json.load(f)["results"]
+    old = saved.get(mode, {})
+    saved[mode] = {}
+    for result in results:
+        name = result["name"]
+        value = {key: value for key, value in result.items() if key != "name"}
+        if (
+            replace
+            or name not in old
+            or old[name]["queries_per_op"] != value["queries_per_op"]
+        ):
+            saved[mode][name] = value
+        else:
+            saved[mode][name] = old[name]
+    with open(BASELINE, "w") as f:
+        json.dump(
+            {
+                "environment": {
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "sqlite": sqlite3.sqlite_version,
+                },
+                "results": dict(sorted(saved.items())),
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+def compare(result, baseline, tolerance):
+    """
+    Compare the result to the baseline, returning a list of regressions
+    (increased query counts) and a list of notes (large slowdowns, which are
+    not treated as regressions since timings are noisy).
+    """
+    if not baseline:
+        return [], []
+    regressions = []
+    notes = []
+    if result["queries_per_op"] > baseline["queries_per_op"]:
+        regressions.append(
+            "queries/op %s > %s"
+            % (result["queries_per_op"], baseline["queries_per_op"])
+        )
+    if result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - tolerance):
+        notes.append(
+            "ops/sec %s < %s"
+            % (result["ops_per_sec"], baseline["ops_per_sec"])
+        )
+    return regressions, notes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--full", action="store_true", help="Include 100k key benchmarks."
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save new results (and changed query counts) to baseline.json.",
+    )
+    parser.add_argument(
+        "--save-all",
+        action="store_true",
+        help="Replace all saved results in baseline.json.",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with an error if any benchmark regressed.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Allowed slowdown in ops/sec before reporting it "
+        "(default: 0.5, i.e. 50%%).  Slowdowns do not fail --check.",
+    )
+    options = parser.parse_args(argv)
+
+    random.seed(0)
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    populate(100 if options.full else 10)
+
+    mode = "full" if options.full else "quick"
+    baseline = load_baseline(mode)
+    results = []
+    failed = False
+    print(
+        "%-32s %8s %12s %12s" % ("benchmark", "ops", "queries/op", "ops/sec")
+    )
+    for func in BENCHMARKS:
+        for result in func(options):
+            regressions, notes = compare(
+                result, baseline.get(result["name"]), options.tolerance
+            )
+            failed = failed or bool(regressions)
+            messages = []
+            if regressions:
+                messages.append("REGRESSION: " + ", ".join(regressions))
+            if notes:
+                messages.append("slower: " + ", ".join(notes))
+            print(
+                "%-32s %8s %12s %12s  %s"
+                % (
+                    result["name"],
+                    result["ops"],
+                    result["queries_per_op"],
+                    result["ops_per_sec"],
+                    "; ".join(messages),
+                )
+            )
+            results.append(result)
+
+    if options.save or options.save_all:
+        save_baseline(mode, results, replace=options.save_all)
+    if options.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+SECRET_KEY = "1234"
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+}
+INSTALLED_APPS = [
+    "natural_keys",
+    "benchmarks.bench_app",
+]
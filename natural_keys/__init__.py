@@ -1,10 +1,35 @@
-from .models import NaturalKeyModel, NaturalKeyModelManager, NaturalKeyQuerySet
+# Exports are loaded lazily so that natural_keys can be added to
+# INSTALLED_APPS (for the management commands) before models are ready.
 
-try:
-    from .serializers import NaturalKeySerializer, NaturalKeyModelSerializer
-except ImportError:
-    NaturalKeySerializer = None
-    NaturalKeyModelSerializer = None
+_exports = {
+    "NaturalKeyModel": ".models",
+    "NaturalKeyModelManager": ".models",
+    "NaturalKeyQuerySet": ".models",
+    "NaturalKeyCache": ".cache",
+    "cache_natural_keys": ".cache",
+    "track_natural_keys": ".instrumentation",
+    "NaturalKeySerializer": ".serializers",
+    "NaturalKeyModelSerializer": ".serializers",
+}
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name)
+        )
+    from importlib import import_module
+
+    try:
+        module = import_module(_exports[name], __name__)
+    except ImportError:
+        if _exports[name] != ".serializers":
+            raise
+        value = None
+    else:
+        value = getattr(module, name)
+    globals()[name] = value
+    return value
 
 
 __all__ = [
@@ -13,4 +38,7 @@ __all__ = [
     "NaturalKeySerializer",
     "NaturalKeyModelSerializer",
     "NaturalKeyQuerySet",
+    "NaturalKeyCache",
+    "cache_natural_keys",
+    "track_natural_keys",
 ]
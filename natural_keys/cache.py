@@ -0,0 +1,370 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.signals import setting_changed
+from django.db.models.signals import post_save, post_delete
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from weakref import WeakSet
+import hashlib
+import threading
+import time
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+_active_cache = ContextVar("natural_key_cache", default=None)
+_caches = WeakSet()
+
+
+class NaturalKeyCache:
+    """
+    Identity map of (model, database, natural key) to objects, with LRU
+    eviction and an optional timeout (in seconds).  Entries are invalidated
+    automatically when the corresponding object is updated or deleted.
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_pk = {}
+        self._lock = threading.RLock()
+        _caches.add(self)
+
+    def get(self, model, using, natural_key, fetch, store=True):
+        """
+        Return the cached object for the natural key, or call fetch() with the
+        natural key values and cache the result (unless store is False).
+        """
+        key = (model, using, tuple(natural_key))
+        found, obj = self._lookup(key)
+        if found:
+            return obj
+        obj = fetch(*natural_key)
+        if store:
+            self._store(key, obj)
+        return obj
+
+    async def aget(self, model, using, natural_key, fetch, store=True):
+        """
+        Async version of get(), for use with a coroutine function as fetch.
+        """
+        key = (model, using, tuple(natural_key))
+        found, obj = self._lookup(key)
+        if found:
+            return obj
+        obj = await fetch(*natural_key)
+        if store:
+            self._store(key, obj)
+        return obj
+
+    def _lookup(self, key):
+        try:
+            hash(key)
+        except TypeError:
+            return False, None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            self.misses += 1
+        return False, None
+
+    def _store(self, key, obj):
+        try:
+            hash(key)
+        except TypeError:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            if self.timeout is None:
+                expires = None
+            else:
+                expires = time.monotonic() + self.timeout
+            self._entries[key] = (obj, expires)
+            self._keys_by_pk.setdefault((key[0], obj.pk), set()).add(key)
+            while self.maxsize and len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, model, pk=None):
+        """
+        Remove cached entries for the given object (or for all objects of the
+        given model, if pk is None).
+        """
+        with self._lock:
+            if pk is None:
+                keys = [key for key in self._entries if key[0] is model]
+            else:
+                keys = list(self._keys_by_pk.get((model, pk), ()))
+            for key in keys:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_pk.clear()
+
+    def cache_info(self):
+        return CacheInfo(
+            self.hits, self.misses, self.maxsize, len(self._entries)
+        )
+
+    def _discard(self, key):
+        obj, expires = self._entries.pop(key)
+        pk_key = (key[0], obj.pk)
+        keys = self._keys_by_pk.get(pk_key)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_pk[pk_key]
+
+
+def get_active_cache():
+    """
+    Return the NaturalKeyCache activated via cache_natural_keys(), if any.
+    """
+    return _active_cache.get()
+
+
+@contextmanager
+def cache_natural_keys(cache=None, **kwargs):
+    """
+    Cache natural key lookups (including nested lookups) within the block.
+    A new NaturalKeyCache is created from kwargs unless one is provided.
+    To scope the cache to a transaction, use this inside atomic().
+    """
+    if cache is None:
+        cache = NaturalKeyCache(**kwargs)
+    token = _active_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _active_cache.reset(token)
+
+
+def get_dependent_models(model, models):
+    """
+    Filter the given models to those whose natural key includes model,
+    directly or via another related model.
+    """
+    dependents = set()
+    for other in models:
+        pending = [other]
+        while pending:
+            current = pending.pop()
+            related = [
+                rel_to
+                for name, rel_to in current.get_natural_key_info()
+                if rel_to
+            ]
+            if model in related:
+                dependents.add(other)
+                break
+            pending.extend(related)
+    return dependents
+
+
+def get_shared_cache():
+    """
+    Return the Django cache configured via settings.NATURAL_KEYS_CACHE (a
+    cache alias), if any.  The shared cache maps natural keys to primary keys
+    so that warm lookups can be shared across processes.
+    """
+    alias = get_shared_cache_alias()
+    if alias:
+        return caches[alias]
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_shared_cache_alias():
+    # Looking up a missing setting is relatively slow, and this is checked
+    # for every object loaded (see NaturalKeyModel.from_db())
+    return getattr(settings, "NATURAL_KEYS_CACHE", None)
+
+
+def clear_shared_cache_alias(setting, **kwargs):
+    if setting == "NATURAL_KEYS_CACHE":
+        get_shared_cache_alias.cache_clear()
+
+
+def natural_key_caches_enabled():
+    """
+    Whether any NaturalKeyCache exists or a shared cache is configured, i.e.
+    whether saves may need to invalidate cached lookups.
+    """
+    return bool(_caches) or get_shared_cache() is not None
+
+
+def get_cached_pks(model, using, natural_keys):
+    """
+    Return a mapping of natural keys to primary keys from the shared cache.
+    Keys not in the cache are omitted.
+    """
+    cache = get_shared_cache()
+    if cache is None:
+        return {}
+    version = _get_cache_version(cache, model)
+    cache_keys = {
+        _make_cache_key(model, using, natural_key): natural_key
+        for natural_key in natural_keys
+    }
+    return {
+        cache_keys[cache_key]: pk
+        for cache_key, pk in cache.get_many(
+            cache_keys, version=version
+        ).items()
+    }
+
+
+def set_cached_pks(model, using, pks):
+    """
+    Store the given mapping of natural keys to primary keys in the shared
+    cache.
+    """
+    cache = get_shared_cache()
+    if cache is None or not pks:
+        return
+    version = _get_cache_version(cache, model)
+    cache.set_many(
+        {
+            _make_cache_key(model, using, natural_key): pk
+            for natural_key, pk in pks.items()
+        },
+        timeout=getattr(
+            settings, "NATURAL_KEYS_CACHE_TIMEOUT", DEFAULT_TIMEOUT
+        ),
+        version=version,
+    )
+
+
+def _make_cache_key(model, using, natural_key):
+    digest = hashlib.md5(repr(tuple(natural_key)).encode()).hexdigest()
+    return "natural_keys:%s:%s:%s" % (model._meta.label_lower, using, digest)
+
+
+def _get_version_key(model):
+    return "natural_keys:%s:version" % model._meta.label_lower
+
+
+def _get_cache_version(cache, model):
+    version_key = _get_version_key(model)
+    version = cache.get(version_key)
+    if version is None:
+        # Start from the current time rather than 1, so that entries from
+        # before an evicted version key are not reused
+        cache.add(version_key, int(time.time() * 1000), timeout=None)
+        version = cache.get(version_key) or int(time.time() * 1000)
+    return version
+
+
+def _bump_cache_version(cache, model):
+    version_key = _get_version_key(model)
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.set(version_key, int(time.time() * 1000), timeout=None)
+
+
+def get_natural_key_models():
+    models = []
+    for model in apps.get_models():
+        if hasattr(model, "get_natural_key_info"):
+            models.append(model)
+    return models
+
+
+def get_natural_key_state(instance):
+    """
+    Return the (local) values of the natural key fields for the instance, or
+    None if any of them are deferred.
+    """
+    data = instance.__dict__
+    try:
+        return tuple(
+            data[attname]
+            for attname in type(instance).get_natural_key_attnames()
+        )
+    except KeyError:
+        return None
+
+
+def natural_key_changed(instance, update_fields=None):
+    """
+    Whether the natural key of a saved instance may have changed since it
+    was loaded (or last saved).
+    """
+    info = type(instance).get_natural_key_info()
+    if update_fields is not None and not any(
+        name in update_fields for name, rel_to in info
+    ):
+        return False
+    state = getattr(instance, "_natural_key_state", None)
+    return state is None or state != get_natural_key_state(instance)
+
+
+def invalidate_cached_object(
+    sender, instance, created=False, update_fields=None, **kwargs
+):
+    is_natural_key_model = hasattr(sender, "get_natural_key_info")
+    if created:
+        # New objects cannot make existing entries stale
+        if is_natural_key_model:
+            instance._natural_key_state = get_natural_key_state(instance)
+        return
+    if not is_natural_key_model:
+        key_changed = False
+    elif kwargs["signal"] is post_delete:
+        key_changed = True
+    else:
+        key_changed = natural_key_changed(instance, update_fields)
+        instance._natural_key_state = get_natural_key_state(instance)
+
+    invalidate_cached_objects(sender, [instance.pk], key_changed)
+
+
+def invalidate_cached_objects(model, pks=None, key_changed=True):
+    """
+    Invalidate cached lookups for the given objects (or for all objects of
+    the model, if pks is None), e.g. after bulk operations that do not send
+    signals.  If key_changed, cached lookups for models whose natural keys
+    depend on model, and the shared cache entries for both, are invalidated
+    as well.
+    """
+    for cache in list(_caches):
+        if pks is None:
+            cache.invalidate(model)
+        else:
+            for pk in pks:
+                cache.invalidate(model, pk)
+        if key_changed:
+            # Natural keys of dependent objects may have changed too
+            models = {key[0] for key in list(cache._entries)}
+            for dependent in get_dependent_models(model, models):
+                cache.invalidate(dependent)
+
+    shared_cache = get_shared_cache()
+    if (
+        shared_cache is not None
+        and key_changed
+        and hasattr(model, "get_natural_key_info")
+    ):
+        _bump_cache_version(shared_cache, model)
+        models = get_natural_key_models()
+        for dependent in get_dependent_models(model, models):
+            _bump_cache_version(shared_cache, dependent)
+
+
+post_save.connect(invalidate_cached_object)
+post_delete.connect(invalidate_cached_object)
+setting_changed.connect(clear_shared_cache_alias)
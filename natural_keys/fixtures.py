@@ -0,0 +1,385 @@
+from django.apps import apps
+from django.core.serializers import sort_dependencies
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, DEFAULT_DB_ALIAS
+from .cache import invalidate_cached_objects
+from .models import chunk_lookups, natural_key_lookup_q
+from .slugs import get_converter
+from itertools import islice
+import json
+
+
+def iter_json_objects(stream, chunk_size=65536):
+    """
+    Iterate over the objects in a JSON array (or in a JSON Lines file),
+    without loading the entire file into memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    in_array = None
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if in_array is None and buffer:
+            in_array = buffer.startswith("[")
+            if in_array:
+                buffer = buffer[1:]
+                continue
+        if in_array and buffer.startswith(","):
+            buffer = buffer[1:]
+            continue
+        if in_array and buffer.startswith("]"):
+            return
+        if buffer:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise DeserializationError("Invalid JSON fixture")
+            else:
+                if end < len(buffer) or eof:
+                    yield obj
+                    buffer = buffer[end:]
+                    continue
+        if eof:
+            if in_array:
+                raise DeserializationError("Unterminated JSON array")
+            return
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+
+class FixtureLoader:
+    """
+    Load serialized objects (in the format used by Django's JSON serializer,
+    with natural keys) in batches.  References to related objects are
+    resolved with one bulk lookup per batch, and rows are written with
+    bulk_create() / bulk_update().  As a result, Model.save() is not called
+    and no pre_save/post_save signals are sent.  Instead, cached natural
+    key lookups are invalidated for any models with updated rows.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, batch_size=1000):
+        self.using = using
+        self.batch_size = batch_size
+        self.count = 0
+
+    def load(self, objects):
+        """
+        Load an iterable of serialized objects, returning the number loaded.
+        Objects are processed in order, so related objects must come first.
+        """
+        start = self.count
+        batch = []
+        model = None
+        self.updated_models = set()
+        with transaction.atomic(using=self.using):
+            for data in objects:
+                next_model = self.get_model(data)
+                if batch and (
+                    next_model is not model or len(batch) >= self.batch_size
+                ):
+                    self.load_batch(model, batch)
+                    batch = []
+                model = next_model
+                batch.append(data)
+            if batch:
+                self.load_batch(model, batch)
+        for model in self.updated_models:
+            # Updates may have changed natural keys, without sending signals
+            invalidate_cached_objects(model)
+        return self.count - start
+
+    def get_model(self, data):
+        try:
+            return apps.get_model(data["model"])
+        except (KeyError, LookupError) as e:
+            raise DeserializationError("Invalid model identifier: %s" % e)
+
+    def load_batch(self, model, batch):
+        opts = model._meta
+        related_keys = {}
+        for data in batch:
+            for name, value in data.get("fields", {}).items():
+                field = opts.get_field(name)
+                if not field.remote_field:
+                    continue
+                values = value if field.many_to_many else [value]
+                for value in values:
+                    if isinstance(value, (list, tuple)):
+                        related_keys.setdefault(name, set()).add(tuple(value))
+
+        related_objs = {
+            name: self.resolve_keys(
+                opts.get_field(name).remote_field.model, keys
+            )
+            for name, keys in related_keys.items()
+        }
+
+        objs = []
+        many_to_many = []
+        update_fields = set()
+        for data in batch:
+            obj = model()
+            m2m_data = {}
+            for name, value in data.get("fields", {}).items():
+                field = opts.get_field(name)
+                if field.many_to_many:
+                    m2m_data[field] = [
+                        self.get_related_pk(field, value, related_objs)
+                        for value in value
+                    ]
+                elif field.remote_field:
+                    setattr(
+                        obj,
+                        field.attname,
+                        self.get_related_pk(field, value, related_objs),
+                    )
+                    update_fields.add(field.name)
+                else:
+                    setattr(obj, field.attname, get_converter(field)(value))
+                    update_fields.add(field.name)
+            if data.get("pk") is not None:
+                obj.pk = opts.pk.to_python(data["pk"])
+            objs.append(obj)
+            many_to_many.append(m2m_data)
+
+        existing = self.get_existing(model, objs)
+        new_objs = [obj for obj in objs if obj.pk not in existing]
+        old_objs = [obj for obj in objs if obj.pk in existing]
+        manager = model._base_manager.db_manager(self.using)
+        if new_objs:
+            manager.bulk_create(new_objs)
+        update_fields.discard(opts.pk.name)
+        if old_objs and update_fields:
+            manager.bulk_update(old_objs, sorted(update_fields))
+            self.updated_models.add(model)
+        if any(many_to_many):
+            self.load_many_to_many(objs, many_to_many)
+        self.count += len(objs)
+
+    def resolve_keys(self, model, keys):
+        """
+        Map natural keys to objects for the given (related) model.
+        """
+        manager = model._default_manager.db_manager(self.using)
+        if hasattr(manager, "resolve_keys"):
+            resolved, success = manager.resolve_keys(keys, bulk=True)
+        elif hasattr(manager, "get_by_natural_key"):
+            resolved = {}
+            for key in keys:
+                try:
+                    resolved[key] = manager.get_by_natural_key(*key)
+                except model.DoesNotExist:
+                    resolved[key] = None
+        else:
+            raise DeserializationError(
+                "%s does not support natural keys" % model._meta.label
+            )
+        for key, obj in resolved.items():
+            if obj is None:
+                raise DeserializationError(
+                    "%s matching natural key %s does not exist"
+                    % (model._meta.label, list(key))
+                )
+        return resolved
+
+    def get_related_pk(self, field, value, related_objs):
+        if field.many_to_many:
+            target_field = field.remote_field.model._meta.pk
+        else:
+            target_field = field.target_field
+        if value is None:
+            return None
+        if isinstance(value, (list, tuple)):
+            obj = related_objs[field.name][tuple(value)]
+            return getattr(obj, target_field.attname)
+        return target_field.to_python(value)
+
+    def get_existing(self, model, objs):
+        """
+        Find existing rows for the given objects, setting the pk of objects
+        without one if their natural key matches an existing row.  Returns
+        the set of existing primary keys.
+        """
+        keyless = [obj for obj in objs if obj.pk is None]
+        queryset = model._base_manager.using(self.using)
+        existing = set()
+        if keyless and hasattr(model, "get_natural_key_info"):
+            attnames = [
+                model._meta.get_field(name).attname
+                for name, rel_to in model.get_natural_key_info()
+            ]
+            rows = {}
+            for obj in keyless:
+                row = tuple(getattr(obj, attname) for attname in attnames)
+                rows.setdefault(row, []).append(obj)
+            for chunk in chunk_lookups(self.using, list(rows), len(attnames)):
+                matches = queryset.filter(
+                    natural_key_lookup_q(attnames, chunk, self.using)
+                ).values_list("pk", *attnames)
+                for pk, *row in matches:
+                    for obj in rows.get(tuple(row), ()):
+                        obj.pk = pk
+                    existing.add(pk)
+
+        pks = {obj.pk for obj in objs if obj.pk is not None} - existing
+        if pks:
+            existing.update(
+                queryset.filter(pk__in=pks).values_list("pk", flat=True)
+            )
+        return existing
+
+    def load_many_to_many(self, objs, many_to_many):
+        through_objs = {}
+        for obj, m2m_data in zip(objs, many_to_many):
+            for field, pks in m2m_data.items():
+                through = field.remote_field.through
+                source = field.m2m_field_name() + "_id"
+                target = field.m2m_reverse_field_name() + "_id"
+                through._base_manager.using(self.using).filter(
+                    **{source: obj.pk}
+                ).delete()
+                through_objs.setdefault(through, []).extend(
+                    through(**{source: obj.pk, target: pk}) for pk in pks
+                )
+        for through, rows in through_objs.items():
+            through._base_manager.db_manager(self.using).bulk_create(rows)
+
+
+class FixtureDumper:
+    """
+    Serialize model tables as JSON Lines (in the format read by
+    FixtureLoader), with natural keys in place of primary keys.  Rows are
+    fetched with values_list().iterator(), joining to related tables for
+    natural keys, so that no model instances are created.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, chunk_size=2000):
+        self.using = using
+        self.chunk_size = chunk_size
+
+    def dump(self, models, stream):
+        """
+        Write the given models to stream, with related models first.
+        Returns the number of objects written.
+        """
+        count = 0
+        encoder = DjangoJSONEncoder()
+        for model in sort_dependencies([(None, models)], allow_cycles=True):
+            for data in self.iter_objects(model):
+                stream.write(encoder.encode(data) + "\n")
+                count += 1
+        return count
+
+    def get_columns(self, model):
+        """
+        Return (name, paths) for each field to serialize.  Foreign keys to
+        models with natural keys have their own column followed by the
+        related natural key fields.
+        """
+        columns = []
+        for field in model._meta.local_concrete_fields:
+            if not field.serialize:
+                continue
+            paths = [field.attname]
+            rel_to = field.remote_field and field.remote_field.model
+            if hasattr(rel_to, "get_natural_key_fields"):
+                paths += [
+                    field.name + "__" + name
+                    for name in rel_to.get_natural_key_fields()
+                ]
+            columns.append((field.name, paths))
+        return columns
+
+    def iter_objects(self, model):
+        """
+        Iterate over serialized objects for the given model.
+        """
+        opts = model._meta
+        natural_primary = hasattr(model, "get_natural_key_fields")
+        columns = self.get_columns(model)
+        m2m_fields = [
+            field
+            for field in opts.many_to_many
+            if field.remote_field.through._meta.auto_created
+        ]
+        queryset = (
+            model._base_manager.using(self.using)
+            .order_by("pk")
+            .values_list(
+                "pk", *(path for n, paths in columns for path in paths)
+            )
+        )
+        rows = queryset.iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            pks = [row[0] for row in chunk]
+            m2m_values = {
+                field.name: self.get_many_to_many(field, pks)
+                for field in m2m_fields
+            }
+            for pk, *row in chunk:
+                fields = {}
+                for name, paths in columns:
+                    values, row = row[: len(paths)], row[len(paths) :]
+                    if len(paths) == 1:
+                        fields[name] = values[0]
+                    elif values[0] is None:
+                        fields[name] = None
+                    else:
+                        fields[name] = values[1:]
+                for name, values in m2m_values.items():
+                    fields[name] = values.get(pk, [])
+                data = {"model": opts.label_lower}
+                if not natural_primary:
+                    data["pk"] = pk
+                data["fields"] = fields
+                yield data
+
+    def get_many_to_many(self, field, pks):
+        """
+        Return a mapping of primary keys to related values (natural keys if
+        available) for a many-to-many field.
+        """
+        through = field.remote_field.through
+        rel_to = field.remote_field.model
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = field.m2m_reverse_field_name()
+        if hasattr(rel_to, "get_natural_key_fields"):
+            paths = [
+                target + "__" + name
+                for name in rel_to.get_natural_key_fields()
+            ]
+        else:
+            paths = [through._meta.get_field(target).attname]
+        values = {}
+        queryset = through._base_manager.using(self.using).order_by("pk")
+        for chunk in chunk_lookups(self.using, pks, 1):
+            for pk, *row in queryset.filter(
+                **{source + "__in": chunk}
+            ).values_list(source, *paths):
+                value = row if len(paths) > 1 else row[0]
+                values.setdefault(pk, []).append(value)
+        return values
+
+
+def load_fixture(stream, using=DEFAULT_DB_ALIAS, batch_size=1000):
+    """
+    Load a JSON or JSON Lines fixture from a file-like object.
+    """
+    loader = FixtureLoader(using=using, batch_size=batch_size)
+    return loader.load(iter_json_objects(stream))
+
+
+def dump_fixture(stream, models, using=DEFAULT_DB_ALIAS, chunk_size=2000):
+    """
+    Write the given models to a file-like object as JSON Lines.
+    """
+    dumper = FixtureDumper(using=using, chunk_size=chunk_size)
+    return dumper.dump(models, stream)
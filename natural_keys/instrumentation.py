@@ -0,0 +1,125 @@
+from django.db import connections
+from collections import namedtuple
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+from functools import wraps
+import time
+
+OperationRecord = namedtuple(
+    "OperationRecord", ["model", "operation", "depth", "queries", "duration"]
+)
+OperationStats = namedtuple(
+    "OperationStats", ["count", "queries", "duration", "max_depth"]
+)
+
+_active_tracker = ContextVar("natural_key_tracker", default=None)
+_depth = ContextVar("natural_key_depth", default=0)
+
+
+class NaturalKeyTracker:
+    """
+    Collect statistics for natural key operations (see track_natural_keys()).
+    Query counts and durations for each operation include any nested
+    operations (e.g. looking up related objects).
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.queries = 0
+        self._stats = {}
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def record(self, record):
+        key = (record.model._meta.label, record.operation)
+        count, queries, duration, max_depth = self._stats.get(
+            key, (0, 0, 0.0, 0)
+        )
+        self._stats[key] = OperationStats(
+            count + 1,
+            queries + record.queries,
+            duration + record.duration,
+            max(max_depth, record.depth),
+        )
+        if self.callback:
+            self.callback(record)
+
+    def summary(self):
+        """
+        Return a mapping of (model label, operation) to OperationStats.
+        """
+        return dict(self._stats)
+
+
+def get_active_tracker():
+    return _active_tracker.get()
+
+
+@contextmanager
+def track_natural_keys(callback=None, using=None):
+    """
+    Record natural key operations (and the queries they run) within the
+    block.  Yields a NaturalKeyTracker; call summary() on it afterwards.
+    If a callback is provided, it is called with an OperationRecord as each
+    operation completes.
+    """
+    tracker = NaturalKeyTracker(callback)
+    aliases = [using] if using else list(connections)
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(
+                connections[alias].execute_wrapper(tracker.count_query)
+            )
+        token = _active_tracker.set(tracker)
+        try:
+            yield tracker
+        finally:
+            _active_tracker.reset(token)
+
+
+@contextmanager
+def record_operation(model, operation):
+    """
+    Record the wrapped natural key operation, if tracking is active.
+    """
+    tracker = _active_tracker.get()
+    if tracker is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    queries = tracker.queries
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _depth.reset(token)
+        tracker.record(
+            OperationRecord(
+                model,
+                operation,
+                depth,
+                tracker.queries - queries,
+                time.perf_counter() - start,
+            )
+        )
+
+
+def instrumented(operation):
+    """
+    Decorator for manager methods, recording them as the given operation.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if _active_tracker.get() is None:
+                return method(self, *args, **kwargs)
+            with record_operation(self.model, operation):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,62 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from natural_keys.fixtures import dump_fixture
+
+
+class Command(BaseCommand):
+    help = (
+        "Write models as JSON Lines, using natural keys in place of primary "
+        "keys, without loading whole tables into memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "args",
+            metavar="app_label[.ModelName]",
+            nargs="*",
+            help="Apps or models to dump.  Defaults to all models with "
+            "natural keys.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help='Database to dump from. Defaults to "default".',
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of rows to fetch at a time.",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            help="File to write to.  Defaults to stdout.",
+        )
+
+    def handle(self, *labels, database, chunk_size, output, **options):
+        models = self.get_models(labels)
+        if output:
+            with open(output, "w", encoding="utf-8") as stream:
+                dump_fixture(stream, models, database, chunk_size)
+        else:
+            dump_fixture(self.stdout, models, database, chunk_size)
+
+    def get_models(self, labels):
+        if not labels:
+            return [
+                model
+                for model in apps.get_models()
+                if hasattr(model, "get_natural_key_fields")
+            ]
+        models = []
+        for label in labels:
+            try:
+                if "." in label:
+                    models.append(apps.get_model(label))
+                else:
+                    models.extend(apps.get_app_config(label).get_models())
+            except LookupError as e:
+                raise CommandError(str(e))
+        return models
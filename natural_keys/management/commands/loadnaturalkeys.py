@@ -0,0 +1,55 @@
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.base import DeserializationError
+from django.db import DEFAULT_DB_ALIAS
+from natural_keys.fixtures import load_fixture
+import sys
+
+
+class Command(BaseCommand):
+    help = (
+        "Load JSON or JSON Lines fixtures that refer to related objects by "
+        "natural key, in batches and without reading whole files into memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "args",
+            metavar="fixture",
+            nargs="+",
+            help="Fixture file paths, or - to read from stdin.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help='Database to load into. Defaults to "default".',
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of objects to resolve and write at a time.",
+        )
+
+    def handle(self, *fixtures, database, batch_size, **options):
+        count = 0
+        for fixture in fixtures:
+            try:
+                if fixture == "-":
+                    count += load_fixture(sys.stdin, database, batch_size)
+                else:
+                    with open(fixture, encoding="utf-8") as stream:
+                        count += load_fixture(stream, database, batch_size)
+            except (
+                OSError,
+                DeserializationError,
+                FieldDoesNotExist,
+                ValidationError,
+            ) as e:
+                raise CommandError("Problem loading %s: %s" % (fixture, e))
+
+        if options["verbosity"] >= 1:
+            self.stdout.write(
+                "Installed %d object(s) from %d fixture(s)"
+                % (count, len(fixtures))
+            )
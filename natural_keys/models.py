@@ -1,25 +1,193 @@
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models.functions import Cast, Coalesce, Replace
+from django.db.models.signals import class_prepared
+from django.core.signals import setting_changed
 from functools import reduce
+from itertools import islice
+from collections import namedtuple
+from weakref import WeakKeyDictionary
+from asgiref.sync import sync_to_async
+from .cache import (
+    get_active_cache,
+    cache_natural_keys,
+    get_shared_cache,
+    get_cached_pks,
+    set_cached_pks,
+    get_natural_key_state,
+    invalidate_cached_objects,
+    natural_key_caches_enabled,
+)
+from .slugs import NaturalKeySlugCodec, get_converter, get_path_field
+from .instrumentation import instrumented
+import asyncio
+import operator
+import sys
+
+BulkUpsertResult = namedtuple(
+    "BulkUpsertResult", ["inserted", "updated", "unchanged"]
+)
+
+# Natural key metadata, computed once per model class
+_natural_key_cache = WeakKeyDictionary()
+
+
+def get_natural_key_cache(model):
+    """
+    Return the natural key metadata cache for the given model class.  The
+    cache is discarded if _natural_key has been set on the model (or on any
+    model its natural key depends on) since the metadata was computed.
+    """
+    cache = _natural_key_cache.get(model)
+    if cache is None or any(
+        getattr(dep, "_natural_key", None) is not stamp
+        for dep, stamp in cache["stamps"]
+    ):
+        cache = {"stamps": [(model, getattr(model, "_natural_key", None))]}
+        _natural_key_cache[model] = cache
+    return cache
+
+
+def clear_natural_key_cache(**kwargs):
+    _natural_key_cache.clear()
+
+
+def clear_natural_key_cache_on_reload(setting, **kwargs):
+    if setting == "INSTALLED_APPS":
+        clear_natural_key_cache()
+
+
+class_prepared.connect(clear_natural_key_cache)
+setting_changed.connect(clear_natural_key_cache_on_reload)
 
 
 class NaturalKeyQuerySet(models.QuerySet):
     def filter(self, *args, **kwargs):
         natural_key_slug = kwargs.pop("natural_key_slug", None)
         if natural_key_slug and type(natural_key_slug) is str:
-            slugs = natural_key_slug.split(self.model.natural_key_separator)
-            fields = self.model.get_natural_key_fields()
-            if len(slugs) > len(fields):
-                slugs[len(fields) - 1 :] = [
-                    self.model.natural_key_separator.join(
-                        slugs[len(fields) - 1 :]
-                    )
-                ]
-            elif len(slugs) < len(fields):
+            slugs = self.split_natural_key_slug(natural_key_slug)
+            if slugs is None:
                 return self.none()
             kwargs.update(self.natural_key_kwargs(*slugs))
 
+        natural_key_slugs = kwargs.pop("natural_key_slug__in", None)
+        natural_keys = kwargs.pop("natural_key__in", None)
+        if natural_key_slugs is not None:
+            keys = [
+                self.split_natural_key_slug(slug) for slug in natural_key_slugs
+            ]
+            args += (self.natural_keys_q(key for key in keys if key),)
+        if natural_keys is not None:
+            args += (self.natural_keys_q(natural_keys),)
+
         return super(NaturalKeyQuerySet, self).filter(*args, **kwargs)
 
+    def split_natural_key_slug(self, natural_key_slug):
+        """
+        Split a slug into natural key values (converted to the natural key
+        field types), or return None if the slug is not valid.
+        """
+        codec = self.model.get_natural_key_slug_codec()
+        return codec.decode(natural_key_slug)
+
+    def natural_keys_q(self, natural_keys):
+        """
+        Build a Q object matching any of the given natural keys.  (If there
+        are no keys, the Q object will match nothing.)
+        """
+        fields = self.model.get_natural_key_fields()
+        rows = []
+        for natural_key in natural_keys:
+            if len(natural_key) != len(fields):
+                raise TypeError(
+                    "Wrong number of values, expected %s" % len(fields)
+                )
+            rows.append(tuple(natural_key))
+        if not rows:
+            return models.Q(pk__in=[])
+        return natural_key_lookup_q(fields, rows, self.db)
+
+    def filter_natural_keys(self, natural_keys):
+        """
+        Filter to objects matching any of the given natural keys.  Keys are
+        compared as row values, e.g. (code, group) IN (...), where supported.
+        """
+        return self.filter(self.natural_keys_q(natural_keys))
+
+    def natural_key_pks(self, natural_keys):
+        """
+        Map the given natural keys to the primary keys of matching objects,
+        without loading the objects.  Only the primary key and (flattened)
+        natural key columns are queried, in chunks sized to the backend's
+        parameter limit.  Keys without a matching object are omitted.
+        """
+        fields = self.model.get_natural_key_fields()
+        codec = self.model.get_natural_key_slug_codec()
+        natural_keys = iter(natural_keys)
+        size = get_chunk_size(self.db, len(fields))
+        found = {}
+        while True:
+            chunk = [tuple(key) for key in islice(natural_keys, size)]
+            if not chunk:
+                return found
+            for key in chunk:
+                if len(key) != len(fields):
+                    raise TypeError(
+                        "Wrong number of values, expected %s" % len(fields)
+                    )
+            found.update(self._fetch_cached_pks(chunk))
+            lookups = {}
+            for key in chunk:
+                row = None if key in found else codec.to_python(key)
+                if row is not None:
+                    lookups.setdefault(tuple(row), []).append(key)
+            if not lookups:
+                continue
+            fetched = {}
+            queryset = self.filter(
+                natural_key_lookup_q(fields, list(lookups), self.db)
+            )
+            for pk, *row in queryset.values_list("pk", *fields):
+                for key in lookups.get(tuple(row), ()):
+                    fetched[key] = pk
+            set_cached_pks(self.model, self.db, fetched)
+            found.update(fetched)
+
+    def _fetch_cached_pks(self, natural_keys):
+        """
+        Return the primary keys in the shared cache for the given keys.  Since
+        cached primary keys may be stale (e.g. after a rollback), they are
+        only returned if the (pk, *natural key) rows still exist.
+        """
+        cached = get_cached_pks(self.model, self.db, natural_keys)
+        if not cached:
+            return {}
+        codec = self.model.get_natural_key_slug_codec()
+        lookups = {}
+        for key, pk in cached.items():
+            values = codec.to_python(key)
+            if values is not None:
+                lookups.setdefault((pk, *values), []).append(key)
+
+        fields = ["pk", *self.model.get_natural_key_fields()]
+        found = {}
+        for chunk in chunk_lookups(self.db, list(lookups), len(fields)):
+            queryset = self.filter(
+                natural_key_lookup_q(fields, chunk, self.db)
+            )
+            for row in queryset.values_list(*fields):
+                for key in lookups.get(tuple(row), ()):
+                    found[key] = row[0]
+        return found
+
+    def missing_natural_keys(self, natural_keys):
+        """
+        Return the set of the given natural keys that do not match any
+        object (see natural_key_pks()).
+        """
+        natural_keys = [tuple(key) for key in natural_keys]
+        found = self.natural_key_pks(natural_keys)
+        return {key for key in natural_keys if key not in found}
+
     def natural_key_kwargs(self, *args):
         natural_key = self.model.get_natural_key_fields()
         if len(args) != len(natural_key):
@@ -28,24 +196,148 @@ class NaturalKeyQuerySet(models.QuerySet):
             )
         return dict(zip(natural_key, args))
 
+    def with_natural_keys(self):
+        """
+        Select the related objects needed to compute natural_key() (and
+        natural_key_slug), to avoid an extra query per row for each
+        ForeignKey in the natural key.
+        """
+        related = {
+            "__".join(path[:-1])
+            for path in self.model.get_natural_key_paths().values()
+            if len(path) > 1
+        }
+        if not related:
+            return self.all()
+        return self.select_related(*sorted(related))
+
+    def natural_keys(self, chunk_size=2000):
+        """
+        Iterate over the natural key tuples for this queryset, fetching only
+        the natural key columns and without instantiating any models.
+        """
+        fields = self.model.get_natural_key_fields()
+        return self.values_list(*fields).iterator(chunk_size=chunk_size)
+
+    def natural_key_map(self, chunk_size=2000, intern=False):
+        """
+        Return a dict mapping natural key tuples to primary keys for this
+        queryset, built in one streaming pass over the pk and (flattened)
+        natural key columns, without instantiating any models.
+
+        If intern is True, equal values are shared between keys (strings via
+        sys.intern()), which saves memory for large tables where parent key
+        values repeat.
+        """
+        fields = self.model.get_natural_key_fields()
+        rows = self.values_list("pk", *fields).iterator(chunk_size=chunk_size)
+        if not intern:
+            return {tuple(row): pk for pk, *row in rows}
+        # Keyed by type as well, since e.g. True, 1 and Decimal("1") are equal
+        values = {}
+        result = {}
+        for pk, *row in rows:
+            key = tuple(
+                (
+                    sys.intern(value)
+                    if type(value) is str
+                    else values.setdefault((type(value), value), value)
+                )
+                for value in row
+            )
+            result[key] = pk
+        return result
+
+    def natural_key_slugs(self, chunk_size=2000):
+        """
+        Iterate over the natural_key_slug values for this queryset, without
+        instantiating any models.
+        """
+        codec = self.model.get_natural_key_slug_codec()
+        for natural_key in self.natural_keys(chunk_size=chunk_size):
+            yield codec.encode(natural_key)
+
+    def with_natural_key_slug(self):
+        """
+        Annotate natural_key_slug as computed by the database, so that it can
+        be used for ordering and other lookups (e.g. startswith).
+        """
+        return self.annotate(
+            natural_key_slug=self.model.get_natural_key_slug_expression()
+        )
+
 
 class NaturalKeyModelManager(models.Manager):
     """
     Manager for use with subclasses of NaturalKeyModel.
     """
 
+    def __init__(self, cache=None, join_nested_keys=False):
+        super(NaturalKeyModelManager, self).__init__()
+        self.cache = cache
+        self.join_nested_keys = join_nested_keys
+
     def get_queryset(self):
         return NaturalKeyQuerySet(self.model, using=self._db)
 
+    @instrumented("get_by_natural_key")
     def get_by_natural_key(self, *args):
         """
         Return the object corresponding to the provided natural key.
 
         (This is a generic implementation of the standard Django function)
+
+        If a NaturalKeyCache was provided to the manager or activated via
+        cache_natural_keys(), it will be used for this and any nested lookups.
+        """
+        cache, store = self._get_cache()
+        if cache is None:
+            return self._get_by_natural_key(*args)
+        if not store:
+            return cache.get(
+                self.model, self.db, args, self._get_by_natural_key, store
+            )
+        with cache_natural_keys(cache):
+            return cache.get(
+                self.model, self.db, args, self._get_by_natural_key
+            )
+
+    def _get_cache(self):
         """
+        Return the NaturalKeyCache to use for lookups (if any), and whether
+        new entries may be stored in it.  The manager's cache outlives any
+        transaction, so objects fetched within one (which may be rolled back)
+        are not stored there, nor is it activated for nested lookups.
+        """
+        cache = get_active_cache()
+        if cache is not None:
+            return cache, True
+        if self.cache is None:
+            return None, False
+        connection = transaction.get_connection(self.db)
+        return self.cache, not connection.in_atomic_block
+
+    def _get_by_natural_key(self, *args):
+        pk = get_cached_pks(self.model, self.db, [args]).get(args)
+        if pk is not None:
+            # The cached pk may be stale (e.g. after a rollback), so check
+            # that it still has the natural key
+            try:
+                return self.get(pk=pk, **self.natural_key_kwargs(*args))
+            except self.model.DoesNotExist:
+                pass
+        obj = self._query_by_natural_key(*args)
+        set_cached_pks(self.model, self.db, {args: obj.pk})
+        return obj
 
+    def _query_by_natural_key(self, *args):
         kwargs = self.natural_key_kwargs(*args)
 
+        if self.join_nested_keys and can_join_natural_key(self.model):
+            # No related manager overrides get_by_natural_key, so the nested
+            # lookups can be combined into a single JOINed query
+            return self.get(**natural_key_join_kwargs(self.model, kwargs))
+
         # Since kwargs already has __ lookups in it, we could just do this:
         # return self.get(**kwargs)
 
@@ -71,6 +363,7 @@ class NaturalKeyModelManager(models.Manager):
 
         return self.get(**kwargs)
 
+    @instrumented("create_by_natural_key")
     def create_by_natural_key(self, *args, defaults=None):
         """
         Create a new object from the provided natural key values.  If the
@@ -98,6 +391,7 @@ class NaturalKeyModelManager(models.Manager):
             attrs = kwargs
         return self.create(**attrs)
 
+    @instrumented("get_or_create_by_natural_key")
     def get_or_create_by_natural_key(self, *args, defaults=None):
         """
         get_or_create + get_by_natural_key
@@ -108,13 +402,31 @@ class NaturalKeyModelManager(models.Manager):
                 False,
             )
         except self.model.DoesNotExist:
-            return (
-                self.create_by_natural_key(
-                    *args,
-                    defaults=defaults,
-                ),
-                True,
-            )
+            return self._create_or_get_by_natural_key(*args, defaults=defaults)
+
+    def _create_or_get_by_natural_key(self, *args, defaults=None):
+        # Like QuerySet.get_or_create(), create within a savepoint so that if
+        # another process creates the object first, it can be fetched instead.
+        # (Related objects are created the same way, via
+        # get_or_create_by_natural_key.)
+        try:
+            with transaction.atomic(using=self.db):
+                return (
+                    self.create_by_natural_key(
+                        *args,
+                        defaults=defaults,
+                    ),
+                    True,
+                )
+        except IntegrityError:
+            try:
+                return (
+                    self.get_by_natural_key(*args),
+                    False,
+                )
+            except self.model.DoesNotExist:
+                pass
+            raise
 
     # Shortcut for common use case
     def find(self, *args, defaults=None):
@@ -128,17 +440,211 @@ class NaturalKeyModelManager(models.Manager):
         )
         return obj
 
+    async def aget_by_natural_key(self, *args):
+        """
+        Async version of get_by_natural_key().  Nested lookups for different
+        related models are run concurrently.
+        """
+        cache, store = self._get_cache()
+        if cache is None:
+            return await self._aget_by_natural_key(*args)
+        if not store:
+            return await cache.aget(
+                self.model, self.db, args, self._aget_by_natural_key, store
+            )
+        with cache_natural_keys(cache):
+            return await cache.aget(
+                self.model, self.db, args, self._aget_by_natural_key
+            )
+
+    async def _aget_by_natural_key(self, *args):
+        if get_shared_cache() is not None:
+            pks = await sync_to_async(get_cached_pks)(
+                self.model, self.db, [args]
+            )
+            pk = pks.get(args)
+            if pk is not None:
+                try:
+                    return await self.aget(
+                        pk=pk, **self.natural_key_kwargs(*args)
+                    )
+                except self.model.DoesNotExist:
+                    pass
+        obj = await self._aquery_by_natural_key(*args)
+        if get_shared_cache() is not None:
+            await sync_to_async(set_cached_pks)(
+                self.model, self.db, {args: obj.pk}
+            )
+        return obj
+
+    async def _aquery_by_natural_key(self, *args):
+        kwargs = self.natural_key_kwargs(*args)
+
+        if self.join_nested_keys and can_join_natural_key(self.model):
+            return await self.aget(
+                **natural_key_join_kwargs(self.model, kwargs)
+            )
+
+        names = []
+        lookups = []
+        for name, rel_to in self.model.get_natural_key_info():
+            if not rel_to:
+                continue
+            nested_key = extract_nested_key(kwargs, rel_to, name)
+            if nested_key:
+                names.append((name, rel_to))
+                lookups.append(aget_by_natural_key(rel_to, nested_key))
+            else:
+                kwargs[name] = None
+
+        results = await asyncio.gather(*lookups, return_exceptions=True)
+        for (name, rel_to), result in zip(names, results):
+            if isinstance(result, rel_to.DoesNotExist):
+                # If related object doesn't exist, assume this one doesn't
+                raise self.model.DoesNotExist()
+            elif isinstance(result, BaseException):
+                raise result
+            kwargs[name] = result
+
+        return await self.aget(**kwargs)
+
+    async def acreate_by_natural_key(self, *args, defaults=None):
+        """
+        Async version of create_by_natural_key().
+        """
+        kwargs = self.natural_key_kwargs(*args)
+        for name, rel_to in self.model.get_natural_key_info():
+            if not rel_to:
+                continue
+            nested_key = extract_nested_key(kwargs, rel_to, name)
+            # Related objects are created one at a time, in case two fields
+            # refer to the same object
+            if nested_key:
+                manager = rel_to.objects
+                if hasattr(manager, "aget_or_create_by_natural_key"):
+                    (
+                        kwargs[name],
+                        is_new,
+                    ) = await manager.aget_or_create_by_natural_key(
+                        *nested_key
+                    )
+                else:
+                    (
+                        kwargs[name],
+                        is_new,
+                    ) = await sync_to_async(
+                        manager.get_or_create_by_natural_key
+                    )(*nested_key)
+            else:
+                kwargs[name] = None
+        if defaults:
+            attrs = defaults
+            attrs.update(kwargs)
+        else:
+            attrs = kwargs
+        return await self.acreate(**attrs)
+
+    async def aget_or_create_by_natural_key(self, *args, defaults=None):
+        """
+        Async version of get_or_create_by_natural_key().
+        """
+        try:
+            return (
+                await self.aget_by_natural_key(*args),
+                False,
+            )
+        except self.model.DoesNotExist:
+            # Savepoints aren't supported by the async ORM API
+            return await sync_to_async(self._create_or_get_by_natural_key)(
+                *args, defaults=defaults
+            )
+
+    async def afind(self, *args, defaults=None):
+        """
+        Async version of find().
+        """
+        obj, is_new = await self.aget_or_create_by_natural_key(
+            *args,
+            defaults=defaults,
+        )
+        return obj
+
+    async def aresolve_keys(self, keys, auto_create=False, bulk=False):
+        """
+        Async version of resolve_keys().  Without auto_create, the keys are
+        looked up concurrently.
+        """
+        if bulk:
+            return await sync_to_async(self._bulk_resolve_keys)(
+                keys, auto_create
+            )
+
+        resolved = {}
+        if auto_create:
+            for key in keys:
+                resolved[key] = await self.afind(*key)
+            return resolved, True
+
+        keys = list(keys)
+        results = await asyncio.gather(
+            *(self.aget_by_natural_key(*key) for key in keys),
+            return_exceptions=True,
+        )
+        success = True
+        for key, result in zip(keys, results):
+            if isinstance(result, self.model.DoesNotExist):
+                success = False
+                result = None
+            elif isinstance(result, BaseException):
+                raise result
+            resolved[key] = result
+        return resolved, success
+
     def natural_key_kwargs(self, *args):
         """
         Convert args into kwargs by merging with model's natural key fieldnames
         """
         return self.get_queryset().natural_key_kwargs(*args)
 
-    def resolve_keys(self, keys, auto_create=False):
+    def filter_natural_keys(self, natural_keys):
+        return self.get_queryset().filter_natural_keys(natural_keys)
+
+    def natural_key_pks(self, natural_keys):
+        return self.get_queryset().natural_key_pks(natural_keys)
+
+    def missing_natural_keys(self, natural_keys):
+        return self.get_queryset().missing_natural_keys(natural_keys)
+
+    def with_natural_keys(self):
+        return self.get_queryset().with_natural_keys()
+
+    def natural_keys(self, chunk_size=2000):
+        return self.get_queryset().natural_keys(chunk_size=chunk_size)
+
+    def natural_key_map(self, chunk_size=2000, intern=False):
+        return self.get_queryset().natural_key_map(
+            chunk_size=chunk_size, intern=intern
+        )
+
+    def natural_key_slugs(self, chunk_size=2000):
+        return self.get_queryset().natural_key_slugs(chunk_size=chunk_size)
+
+    def with_natural_key_slug(self):
+        return self.get_queryset().with_natural_key_slug()
+
+    @instrumented("resolve_keys")
+    def resolve_keys(self, keys, auto_create=False, bulk=False):
         """
         Resolve the list of given keys into objects, if possible.
         Returns a mapping and a success indicator.
+
+        If bulk is True, the keys are resolved with a small number of
+        set-based queries (one batch per model) instead of calling
+        get_by_natural_key() once per key.
         """
+        if bulk:
+            return self._bulk_resolve_keys(keys, auto_create)
+
         resolved = {}
         success = True
         for key in keys:
@@ -152,6 +658,316 @@ class NaturalKeyModelManager(models.Manager):
                     resolved[key] = None
         return resolved, success
 
+    @instrumented("bulk_get_or_create_by_natural_key")
+    def bulk_get_or_create_by_natural_key(
+        self, keys, defaults=None, batch_size=None, ignore_conflicts=False
+    ):
+        """
+        Bulk version of get_or_create_by_natural_key().  Existing objects are
+        fetched in bulk, and any missing objects are created via bulk_create(),
+        after first getting or creating their related objects the same way.
+        (Since bulk_create() does not support multi-table inheritance, missing
+        objects for such models are created one at a time instead.)
+        defaults, if provided, should map keys to dicts of additional values.
+        Returns a mapping of each key to its object.
+
+        If ignore_conflicts is True, rows created concurrently by another
+        process are skipped rather than raising IntegrityError, and the
+        created objects are then fetched with one more query.
+        """
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        defaults = defaults or {}
+        found = self._fetch_by_natural_keys(keys)
+        missing = [key for key in keys if key not in found]
+        if not missing:
+            return {key: found[key] for key in keys}
+
+        if self.model._meta.parents:
+            created = self._create_by_natural_keys(missing, defaults)
+            return {
+                key: found[key] if key in found else created[key]
+                for key in keys
+            }
+
+        created, new_objs = self._build_by_natural_keys(
+            missing, defaults, batch_size, ignore_conflicts
+        )
+        self.bulk_create(
+            new_objs,
+            batch_size=batch_size,
+            ignore_conflicts=ignore_conflicts,
+        )
+        if any(obj.pk is None for obj in new_objs):
+            # Backend can't return primary keys from bulk inserts (or some
+            # rows may have been skipped)
+            created = self._fetch_by_natural_keys(missing)
+
+        return {
+            key: found[key] if key in found else created[key] for key in keys
+        }
+
+    def _create_by_natural_keys(self, keys, defaults):
+        """
+        Create objects for the given (missing) keys one at a time, for models
+        that bulk_create() does not support.  As in find(), an object created
+        concurrently (or for an equivalent key) is fetched instead.
+        """
+        return {
+            key: self._create_or_get_by_natural_key(
+                *key, defaults=dict(defaults.get(key) or {})
+            )[0]
+            for key in keys
+        }
+
+    def _build_by_natural_keys(
+        self, keys, defaults, batch_size=None, ignore_conflicts=False
+    ):
+        """
+        Get or create the related objects for the given (missing) keys, and
+        return a mapping of keys to new, unsaved objects, along with a list
+        of the distinct objects to be saved.
+        """
+        info = self.model.get_natural_key_info()
+        key_kwargs, nested_keys = self._split_natural_keys(keys)
+
+        # Parents first, then children
+        nested_objs = {}
+        for name, rel_to in info:
+            if rel_to and nested_keys[name]:
+                nested_objs[name] = (
+                    rel_to.objects.bulk_get_or_create_by_natural_key(
+                        nested_keys[name],
+                        batch_size=batch_size,
+                        ignore_conflicts=ignore_conflicts,
+                    )
+                )
+
+        created = {}
+        new_objs = {}
+        for key, kwargs in key_kwargs.items():
+            lookup = self._natural_key_lookup(kwargs, nested_objs)
+            if lookup not in new_objs:
+                attrs = dict(defaults.get(key) or {})
+                for name, rel_to in info:
+                    if rel_to and kwargs[name] is not None:
+                        kwargs[name] = nested_objs[name][kwargs[name]]
+                attrs.update(kwargs)
+                new_objs[lookup] = self.model(**attrs)
+            created[key] = new_objs[lookup]
+        return created, list(new_objs.values())
+
+    @instrumented("bulk_update_or_create_by_natural_key")
+    def bulk_update_or_create_by_natural_key(self, records, batch_size=None):
+        """
+        Insert or update objects from a mapping of natural keys to dicts of
+        (non-key) field values.  Existing objects are fetched in bulk, and
+        only the fields that have changed are updated.  Missing objects (and
+        their related objects) are created as in
+        bulk_get_or_create_by_natural_key().  Returns the number of inserted,
+        updated, and unchanged objects.
+        """
+        records = {tuple(key): values for key, values in records.items()}
+        found = self._fetch_by_natural_keys(list(records))
+
+        changed_objs = []
+        update_fields = set()
+        unchanged = 0
+        for key, obj in found.items():
+            changed = False
+            for name, value in records[key].items():
+                field = self.model._meta.get_field(name)
+                if isinstance(value, models.Model):
+                    value = value.pk
+                else:
+                    value = get_converter(field)(value)
+                if getattr(obj, field.attname) != value:
+                    setattr(obj, field.attname, value)
+                    update_fields.add(field.name)
+                    changed = True
+            if changed:
+                changed_objs.append(obj)
+            else:
+                unchanged += 1
+
+        missing = [key for key in records if key not in found]
+        new_objs = []
+        inherited = bool(self.model._meta.parents)
+        if missing and inherited:
+            # bulk_create() doesn't support multi-table inheritance
+            created = self._create_by_natural_keys(missing, records)
+            new_objs = list({obj.pk: obj for obj in created.values()}.values())
+        elif missing:
+            created, new_objs = self._build_by_natural_keys(
+                missing, records, batch_size
+            )
+            self.bulk_create(new_objs, batch_size=batch_size)
+
+        features = connections[self.db].features
+        if (
+            changed_objs
+            and features.supports_update_conflicts_with_target
+            and not inherited
+        ):
+            # Update changed rows with INSERT ... ON CONFLICT (pk) DO UPDATE,
+            # which scales better than the CASE expressions of bulk_update()
+            self.bulk_create(
+                changed_objs,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=[self.model._meta.pk.name],
+                update_fields=sorted(update_fields),
+            )
+        elif changed_objs:
+            self.bulk_update(
+                changed_objs, sorted(update_fields), batch_size=batch_size
+            )
+        if changed_objs:
+            # Bulk updates don't send signals, so invalidate caches directly
+            key_fields = {
+                name for name, rel_to in self.model.get_natural_key_info()
+            }
+            invalidate_cached_objects(
+                self.model,
+                [obj.pk for obj in changed_objs],
+                key_changed=bool(update_fields & key_fields),
+            )
+
+        return BulkUpsertResult(len(new_objs), len(changed_objs), unchanged)
+
+    def _bulk_resolve_keys(self, keys, auto_create=False):
+        if auto_create:
+            return self.bulk_get_or_create_by_natural_key(keys), True
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        found = self._fetch_by_natural_keys(keys)
+        resolved = {key: found.get(key) for key in keys}
+        return resolved, len(found) == len(keys)
+
+    def _fetch_by_natural_keys(self, keys):
+        """
+        Return a mapping of the given keys to existing objects.  Keys that do
+        not match an existing object are omitted.  Nested natural keys are
+        resolved in bulk via the related model's manager first, after which
+        the target rows are queried in chunks sized to the backend's
+        parameter limit.
+        """
+        found = self._fetch_cached_natural_keys(keys)
+        keys = [key for key in keys if key not in found]
+        if not keys:
+            return found
+
+        info = self.model.get_natural_key_info()
+        key_kwargs, nested_keys = self._split_natural_keys(keys)
+
+        nested_objs = {}
+        for name, rel_to in info:
+            if rel_to and nested_keys[name]:
+                nested_objs[name] = rel_to.objects.resolve_keys(
+                    nested_keys[name], bulk=True
+                )[0]
+
+        lookups = {}
+        for key, kwargs in key_kwargs.items():
+            lookup = self._natural_key_lookup(kwargs, nested_objs)
+            if lookup is not None:
+                lookups.setdefault(lookup, []).append(key)
+
+        attnames = self.model.get_natural_key_attnames()
+        fetched = {}
+        for chunk in chunk_lookups(self.db, list(lookups), len(attnames)):
+            for obj in self.filter(
+                natural_key_lookup_q(attnames, chunk, self.db)
+            ):
+                row = tuple(getattr(obj, attname) for attname in attnames)
+                for key in lookups.get(row, ()):
+                    fetched[key] = obj
+        set_cached_pks(
+            self.model,
+            self.db,
+            {key: obj.pk for key, obj in fetched.items()},
+        )
+        found.update(fetched)
+        return found
+
+    def _fetch_cached_natural_keys(self, keys):
+        """
+        Fetch objects for keys with primary keys in the shared cache.  Since
+        cached primary keys may be stale (e.g. after a rollback), each object
+        is matched on both its primary key and its natural key.
+        """
+        codec = self.model.get_natural_key_slug_codec()
+        rows = {}
+        for key, pk in get_cached_pks(self.model, self.db, keys).items():
+            values = codec.to_python(key)
+            if values is not None:
+                rows[key] = (pk, *values)
+        rows_by_pk = {}
+        for row in rows.values():
+            rows_by_pk.setdefault(row[0], set()).add(row)
+
+        fields = ["pk", *self.model.get_natural_key_fields()]
+        lookups = list(set(rows.values()))
+        objs = {}
+        for chunk in chunk_lookups(self.db, lookups, len(fields)):
+            objs.update(
+                (obj.pk, obj)
+                for obj in self.filter(
+                    natural_key_lookup_q(fields, chunk, self.db)
+                )
+            )
+
+        found = {}
+        for key, row in rows.items():
+            # If different keys were cached for the same pk, it is unclear
+            # which one matched
+            if row[0] in objs and len(rows_by_pk[row[0]]) == 1:
+                found[key] = objs[row[0]]
+        return found
+
+    def _split_natural_keys(self, keys):
+        """
+        Convert keys into kwargs, replacing the flattened values for each
+        related object with a tuple of its natural key (or None).  Also
+        returns the set of nested keys for each related field.
+        """
+        info = self.model.get_natural_key_info()
+        key_kwargs = {}
+        nested_keys = {name: set() for name, rel_to in info if rel_to}
+        for key in keys:
+            kwargs = self.natural_key_kwargs(*key)
+            for name, rel_to in info:
+                if not rel_to:
+                    continue
+                nested_key = extract_nested_key(kwargs, rel_to, name)
+                if nested_key:
+                    kwargs[name] = tuple(nested_key)
+                    nested_keys[name].add(kwargs[name])
+                else:
+                    kwargs[name] = None
+            key_kwargs[key] = kwargs
+        return key_kwargs, nested_keys
+
+    def _natural_key_lookup(self, kwargs, nested_objs):
+        """
+        Normalize split kwargs into a tuple of database values, matching the
+        attnames of the natural key fields.  Returns None if a related object
+        does not exist.
+        """
+        values = []
+        for name, rel_to in self.model.get_natural_key_info():
+            value = kwargs[name]
+            if value is None:
+                pass
+            elif rel_to:
+                obj = nested_objs[name][value]
+                if obj is None:
+                    # If related object doesn't exist, neither does this one
+                    return None
+                value = obj.pk
+            else:
+                value = get_converter(self.model._meta.get_field(name))(value)
+            values.append(value)
+        return tuple(values)
+
 
 class NaturalKeyModel(models.Model):
     """
@@ -160,12 +976,24 @@ class NaturalKeyModel(models.Model):
 
     objects = NaturalKeyModelManager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(NaturalKeyModel, cls).from_db(db, field_names, values)
+        if natural_key_caches_enabled():
+            # Track the loaded natural key, so that cache versions are only
+            # bumped on save if it changes.  (Without it, a change is assumed.)
+            instance._natural_key_state = get_natural_key_state(instance)
+        return instance
+
     @classmethod
     def get_natural_key_info(cls):
         """
         Derive natural key from first unique_together definition, noting which
         fields are related objects vs. regular fields.
         """
+        cache = get_natural_key_cache(cls)
+        if "info" in cache:
+            return list(cache["info"])
         fields = cls.get_natural_key_def()
         info = []
         for name in fields:
@@ -179,10 +1007,32 @@ class NaturalKeyModel(models.Model):
                 else:
                     rel_to = None
             info.append((name, rel_to))
+        cache["info"] = tuple(info)
         return info
 
+    @classmethod
+    def get_natural_key_attnames(cls):
+        """
+        Return the database attribute names (e.g. parent_id) of the local
+        natural key fields.
+        """
+        cache = get_natural_key_cache(cls)
+        if "attnames" not in cache:
+            cache["attnames"] = tuple(
+                cls._meta.get_field(name).attname
+                for name, rel_to in cls.get_natural_key_info()
+            )
+        return cache["attnames"]
+
     @classmethod
     def get_natural_key_def(cls):
+        cache = get_natural_key_cache(cls)
+        if "def" not in cache:
+            cache["def"] = cls._get_natural_key_def()
+        return cache["def"]
+
+    @classmethod
+    def _get_natural_key_def(cls):
         if hasattr(cls, "_natural_key"):
             return cls._natural_key
 
@@ -210,6 +1060,9 @@ class NaturalKeyModel(models.Model):
         Determine actual natural key field list, incorporating the natural keys
         of related objects as needed.
         """
+        cache = get_natural_key_cache(cls)
+        if "fields" in cache:
+            return cache["fields"]
         natural_key = []
         for name, rel_to in cls.get_natural_key_info():
             if not rel_to:
@@ -219,7 +1072,23 @@ class NaturalKeyModel(models.Model):
                 natural_key.extend(
                     [name + "__" + nname for nname in nested_key]
                 )
-        return tuple(natural_key)
+                # Recompute if the related natural key changes
+                cache["stamps"].extend(get_natural_key_cache(rel_to)["stamps"])
+        cache["fields"] = tuple(natural_key)
+        return cache["fields"]
+
+    @classmethod
+    def get_natural_key_paths(cls):
+        """
+        Return a mapping of each natural key field to its "__"-separated parts.
+        """
+        cache = get_natural_key_cache(cls)
+        if "paths" not in cache:
+            cache["paths"] = {
+                field: tuple(field.split("__"))
+                for field in cls.get_natural_key_fields()
+            }
+        return cache["paths"]
 
     def natural_key(self):
         """
@@ -235,39 +1104,346 @@ class NaturalKeyModel(models.Model):
     def get_natural_key_value(self, field):
         # Recursively extract properties from related objects if needed
         obj = self
-        for part in field.split("__"):
+        parts = self.get_natural_key_paths().get(field) or field.split("__")
+        for part in parts:
             obj = getattr(obj, part)
             if obj is None:
                 return None
         return obj
 
     natural_key_separator = "-"
+    natural_key_slug_escape = None
+
+    @classmethod
+    def get_natural_key_slug_codec(cls):
+        """
+        Return the (cached) NaturalKeySlugCodec for this model.
+        """
+        cache = get_natural_key_cache(cls)
+        if "slug_codec" not in cache:
+            paths = cls.get_natural_key_paths()
+            cache["slug_codec"] = NaturalKeySlugCodec(
+                [
+                    get_path_field(cls, paths[field])
+                    for field in cls.get_natural_key_fields()
+                ],
+                cls.natural_key_separator,
+                cls.natural_key_slug_escape,
+            )
+        return cache["slug_codec"]
 
     @property
     def natural_key_slug(self):
-        return self.natural_key_separator.join(
-            str(slug) for slug in self.natural_key()
+        return self.get_natural_key_slug_codec().encode(self.natural_key())
+
+    @natural_key_slug.setter
+    def natural_key_slug(self, value):
+        # Ignore values from with_natural_key_slug(); the slug is always
+        # computed from the current natural key
+        pass
+
+    @classmethod
+    def get_natural_key_slug_expression(cls):
+        """
+        Return a database expression equivalent to natural_key_slug.
+        """
+        return natural_key_slug_expression(
+            cls.get_natural_key_fields(),
+            cls.natural_key_separator,
+            cls.natural_key_slug_escape,
+        )
+
+    @classmethod
+    def get_natural_key_slug_index(cls, name, **kwargs):
+        """
+        Return a functional index on natural_key_slug, for use in migrations.
+        Only natural keys made up of text and integer fields on the model
+        itself can be indexed this way.  (Other types, such as dates, are
+        converted to text differently depending on database settings, so
+        e.g. PostgreSQL does not allow them in an index expression.)
+        """
+        fields = cls.get_natural_key_fields()
+        if any("__" in field for field in fields):
+            raise NotImplementedError(
+                "Cannot index natural_key_slug for '%s', since it includes "
+                "fields from related models." % cls._meta.model_name
+            )
+        for field in fields:
+            if not isinstance(
+                cls._meta.get_field(field),
+                (models.CharField, models.TextField, models.IntegerField),
+            ):
+                raise NotImplementedError(
+                    "Cannot index natural_key_slug for '%s', since '%s' is "
+                    "not a text or integer field."
+                    % (cls._meta.model_name, field)
+                )
+        return models.Index(
+            cls.get_natural_key_slug_expression(), name=name, **kwargs
         )
 
     class Meta:
         abstract = True
 
 
+NATURAL_KEY_BATCH_SIZE = 1000
+OR_GROUP_SIZE = 100
+
+
+class SlugConcat(models.Func):
+    """
+    Concatenate text expressions with ||.  Unlike CONCAT(), this is
+    immutable on PostgreSQL, so it can be used in an index.
+    """
+
+    arg_joiner = " || "
+    template = "(%(expressions)s)"
+    output_field = models.TextField()
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # || is a logical OR in MySQL by default
+        return self.as_sql(
+            compiler,
+            connection,
+            template="CONCAT(%(expressions)s)",
+            arg_joiner=", ",
+            **extra_context,
+        )
+
+
+def natural_key_slug_expression(fields, separator="-", escape=None):
+    """
+    Build an expression that computes natural_key_slug for the given
+    (flattened) natural key fields.  Null values become "None", as they do in
+    Python.  Note that some types (e.g. dates and booleans) may be converted
+    to text differently than in Python, depending on the database.
+    """
+    parts = []
+    for field in fields:
+        if parts:
+            parts.append(models.Value(separator))
+        value = Coalesce(
+            Cast(field, output_field=models.TextField()),
+            models.Value("None"),
+        )
+        if escape:
+            value = Replace(
+                Replace(value, models.Value(escape), models.Value(escape * 2)),
+                models.Value(separator),
+                models.Value(escape + separator),
+            )
+        parts.append(value)
+    if len(parts) == 1:
+        return parts[0]
+    return SlugConcat(*parts)
+
+
+def get_chunk_size(using, num_fields):
+    """
+    Return the number of lookup rows that fit within the database's query
+    parameter limit.
+    """
+    max_params = connections[using].features.max_query_params
+    if max_params:
+        return max(max_params // num_fields, 1)
+    return NATURAL_KEY_BATCH_SIZE
+
+
+def chunk_lookups(using, lookups, num_fields):
+    """
+    Split a list of lookup rows into chunks that fit within the database's
+    query parameter limit.
+    """
+    size = get_chunk_size(using, num_fields)
+    for start in range(0, len(lookups), size):
+        yield lookups[start : start + size]
+
+
+class NaturalKeyIn(models.Expression):
+    """
+    Match rows whose values for the given fields are any of the given rows,
+    via a row value comparison: (a, b) IN ((%s, %s), (%s, %s), ...).
+    Fields may span relationships (e.g. "parent__code").  Since NULL never
+    compares equal, rows containing None will not match.
+    """
+
+    output_field = models.BooleanField()
+    conditional = True
+
+    def __init__(self, fields, rows):
+        super(NaturalKeyIn, self).__init__()
+        self.fields = [
+            models.F(field) if isinstance(field, str) else field
+            for field in fields
+        ]
+        self.rows = [tuple(row) for row in rows]
+
+    def get_source_expressions(self):
+        return self.fields
+
+    def set_source_expressions(self, exprs):
+        self.fields = exprs
+
+    def as_sql(self, compiler, connection, values_template="(%s)"):
+        columns = []
+        params = []
+        for field in self.fields:
+            sql, field_params = compiler.compile(field)
+            columns.append(sql)
+            params.extend(field_params)
+        targets = [field.output_field for field in self.fields]
+        placeholder = "(%s)" % ", ".join(["%s"] * len(targets))
+        for row in self.rows:
+            params.extend(
+                target.get_db_prep_value(value, connection)
+                for target, value in zip(targets, row)
+            )
+        values = values_template % ", ".join([placeholder] * len(self.rows))
+        return "(%s) IN %s" % (", ".join(columns), values), params
+
+    def as_sqlite(self, compiler, connection):
+        # SQLite only accepts row values in IN () via a subquery
+        return self.as_sql(compiler, connection, values_template="(VALUES %s)")
+
+
+def supports_row_values(connection):
+    """
+    Whether the database supports (a, b) IN (...) comparisons.
+    """
+    return connection.vendor in ("postgresql", "mysql", "sqlite")
+
+
+def natural_key_lookup_q(fields, rows, using=None):
+    """
+    Build a Q object matching any of the given rows of field values.  If the
+    database alias is given and supports row values, rows without nulls are
+    matched with a single NaturalKeyIn expression.  Otherwise, rows are
+    grouped by all but their last value, so that each group can be matched
+    with a single IN clause rather than a long chain of ORs.
+    """
+    rows = [tuple(row) for row in rows]
+    query = models.Q()
+    if (
+        using is not None
+        and len(fields) > 1
+        and supports_row_values(connections[using])
+    ):
+        complete = [row for row in rows if None not in row]
+        if complete:
+            query = models.Q(NaturalKeyIn(fields, complete))
+        rows = [row for row in rows if None in row]
+
+    *prefix_fields, last_field = fields
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[:-1]), {})[row[-1]] = True
+
+    group_queries = []
+    for prefix, group in groups.items():
+        values = [value for value in group if value is not None]
+        last = models.Q()
+        if values:
+            last |= models.Q(**{last_field + "__in": values})
+        if len(values) < len(group):
+            last |= models.Q(**{last_field + "__isnull": True})
+        group_queries.append(
+            models.Q(**dict(zip(prefix_fields, prefix))) & last
+        )
+    if group_queries:
+        query |= combine_or(group_queries)
+    return query
+
+
+def combine_or(queries):
+    """
+    Combine Q objects with OR.  Since Django flattens nested ORs, and some
+    databases limit expression depth (e.g. SQLite allows 1000 levels, and
+    parses each OR as a level), long chains are split into parenthesized
+    groups of at most OR_GROUP_SIZE terms.
+    """
+    while len(queries) > OR_GROUP_SIZE:
+        queries = [
+            models.Q(
+                models.ExpressionWrapper(
+                    reduce(operator.or_, queries[i : i + OR_GROUP_SIZE]),
+                    output_field=models.BooleanField(),
+                )
+            )
+            for i in range(0, len(queries), OR_GROUP_SIZE)
+        ]
+    return reduce(operator.or_, queries)
+
+
+def can_join_natural_key(model):
+    """
+    Determine whether the natural key for model can be looked up with a single
+    query, i.e. whether none of the related models (recursively) have a
+    manager that overrides get_by_natural_key().
+    """
+    for name, rel_to in model.get_natural_key_info():
+        if not rel_to:
+            continue
+        method = getattr(type(rel_to.objects), "get_by_natural_key", None)
+        if method is not NaturalKeyModelManager.get_by_natural_key:
+            return False
+        if not can_join_natural_key(rel_to):
+            return False
+    return True
+
+
+def natural_key_join_kwargs(model, kwargs):
+    """
+    Convert natural key kwargs into lookups for a single JOINed query.  As in
+    get_by_natural_key(), a related object is treated as null if its entire
+    nested key is null.
+    """
+    for name, rel_to in model.get_natural_key_info():
+        if not rel_to:
+            continue
+        nested_key = extract_nested_key(kwargs, rel_to, name)
+        if nested_key:
+            nested_kwargs = natural_key_join_kwargs(
+                rel_to, dict(zip(rel_to.get_natural_key_fields(), nested_key))
+            )
+            for nname, value in nested_kwargs.items():
+                kwargs[name + "__" + nname] = value
+        else:
+            kwargs[name] = None
+    return kwargs
+
+
+async def aget_by_natural_key(model, natural_key):
+    """
+    Look up a related object asynchronously, falling back to the sync API
+    for managers without aget_by_natural_key().
+    """
+    manager = model.objects
+    if hasattr(manager, "aget_by_natural_key"):
+        return await manager.aget_by_natural_key(*natural_key)
+    return await sync_to_async(manager.get_by_natural_key)(*natural_key)
+
+
 def extract_nested_key(key, cls, prefix=""):
     nested_key = cls.get_natural_key_fields()
-    local_fields = {field.name: field for field in cls._meta.local_fields}
+    cache = get_natural_key_cache(cls)
+    if "datetime_fields" not in cache:
+        cache["datetime_fields"] = {
+            field.name
+            for field in cls._meta.local_fields
+            if type(field).__name__ == "DateTimeField"
+        }
+    datetime_fields = cache["datetime_fields"]
     values = []
     has_val = False
     if prefix:
         prefix += "__"
     for nname in nested_key:
         val = key.pop(prefix + nname, None)
-        if val is None and nname in local_fields:
-            if type(local_fields[nname]).__name__ == "DateTimeField":
-                date = key.pop(nname + "_date", None)
-                time = key.pop(nname + "_time", None)
-                if date and time:
-                    val = "%s %s" % (date, time)
+        if val is None and nname in datetime_fields:
+            date = key.pop(nname + "_date", None)
+            time = key.pop(nname + "_time", None)
+            if date and time:
+                val = "%s %s" % (date, time)
 
         if val is not None:
             has_val = True
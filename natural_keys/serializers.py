@@ -1,9 +1,73 @@
+from django.db import connections
 from rest_framework import serializers
 from rest_framework.utils import model_meta
 from rest_framework.validators import UniqueValidator
 from html_json_forms.serializers import JSONFormModelSerializer
-from .models import NaturalKeyModel
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.settings import api_settings
+from .models import NaturalKeyModel, chunk_lookups, natural_key_lookup_q
+from .cache import get_cached_pks, set_cached_pks
+from .instrumentation import record_operation
 from collections import OrderedDict
+from functools import lru_cache
+from weakref import WeakKeyDictionary
+import copy
+
+SERIALIZER_CACHE_SIZE = 256
+
+_natural_key_fields = WeakKeyDictionary()
+_natural_key_plans = WeakKeyDictionary()
+
+
+def get_serializer_class(base_class, model_class, **kwargs):
+    """
+    Return the (memoized) result of base_class._build_for_model(), so that
+    for_model() returns the same class for the same arguments.
+    """
+    include_fields = kwargs.get("include_fields")
+    if include_fields and not isinstance(include_fields, str):
+        kwargs["include_fields"] = tuple(include_fields)
+    return _get_serializer_class(
+        base_class, model_class, tuple(sorted(kwargs.items()))
+    )
+
+
+@lru_cache(maxsize=SERIALIZER_CACHE_SIZE)
+def _get_serializer_class(base_class, model_class, kwargs):
+    return base_class._build_for_model(model_class, **dict(kwargs))
+
+
+def get_natural_key(model_class, validated_data):
+    """
+    Extract the natural key for model_class from nested validated data.
+    """
+    natural_key_paths = model_class.get_natural_key_paths()
+    natural_key = []
+    for field in model_class.get_natural_key_fields():
+        val = validated_data
+        for key in natural_key_paths[field]:
+            val = val[key]
+        natural_key.append(val)
+    return tuple(natural_key)
+
+
+def get_or_create_by_natural_keys(model_class, keys, bulk_create=False):
+    """
+    Look up the objects for the given natural keys in bulk, then create any
+    missing objects via find(), so that save(), signals, and any manager
+    overrides apply as they do for a single item.  If bulk_create is True
+    (and the model does not use multi-table inheritance), missing objects
+    are created with bulk_create() instead.  Returns a mapping of keys to
+    objects.
+    """
+    manager = model_class.objects
+    if bulk_create and not model_class._meta.parents:
+        return manager.bulk_get_or_create_by_natural_key(keys)
+    objs, success = manager.resolve_keys(keys, bulk=True)
+    for key, obj in objs.items():
+        if obj is None:
+            objs[key] = manager.find(*key)
+    return objs
 
 
 class NaturalKeyValidator(serializers.UniqueTogetherValidator):
@@ -16,29 +80,42 @@ class NaturalKeyValidator(serializers.UniqueTogetherValidator):
             self.serializer = serializer
             super(NaturalKeyValidator, self).set_context(serializer)
 
+    def __call__(self, attrs, *args):
+        serializer = args[0] if args else None
+        if isinstance(
+            getattr(serializer, "parent", None), NaturalKeyListSerializer
+        ):
+            # Uniqueness is checked for the whole list via validate_batch()
+            self.enforce_required_fields(attrs, serializer)
+            return
+        return super(NaturalKeyValidator, self).__call__(attrs, *args)
+
+    def get_nested_fields(self, serializer):
+        return {
+            name: serializer.fields[name]
+            for name in self.fields
+            if isinstance(serializer.fields[name], NaturalKeySerializer)
+        }
+
     def filter_queryset(self, attrs, queryset, serializer=None):
         if not serializer:
             # DRF 3.10 and older
             serializer = self.serializer
 
-        nested_fields = {
-            name: serializer.fields[name]
-            for name in self.fields
-            if isinstance(serializer.fields[name], NaturalKeySerializer)
-        }
+        nested_fields = self.get_nested_fields(serializer)
 
         attrs = attrs.copy()
         for field in attrs:
             if field in nested_fields:
                 assert isinstance(attrs[field], dict)
                 cls = nested_fields[field].Meta.model
-                result = cls._default_manager.filter(**attrs[field])
-                if result.count() == 0:
+                pk = self.get_nested_pk(cls, attrs[field])
+                if pk is None:
                     # No existing nested object for these values
                     return queryset.none()
                 else:
                     # Existing nested object, use it to validate
-                    attrs[field] = result[0].pk
+                    attrs[field] = pk
 
         if getattr(self, "requires_context", None):
             # DRF 3.11+
@@ -51,6 +128,187 @@ class NaturalKeyValidator(serializers.UniqueTogetherValidator):
                 attrs, queryset
             )
 
+    def validate_batch(self, items, serializer):
+        """
+        Check a list of validated items for uniqueness, both against the
+        database (using a few set-based queries) and within the list itself.
+        Returns a list with an error message (or None) for each item.
+        """
+        nested_fields = self.get_nested_fields(serializer)
+        sources = [serializer.fields[name].source for name in self.fields]
+        queryset = self.queryset.all()
+        model_class = queryset.model
+
+        # Resolve all nested natural keys at once
+        nested_objs = {}
+        for name, field in nested_fields.items():
+            keys = {
+                field.get_natural_key(item[field.source])
+                for item in items
+                if item.get(field.source) is not None
+            }
+            nested_objs[name] = field.Meta.model.objects.resolve_keys(
+                keys, bulk=True
+            )[0]
+
+        rows = []
+        for item in items:
+            key = []
+            row = []
+            for name, source in zip(self.fields, sources):
+                value = item.get(source)
+                if value is not None and name in nested_fields:
+                    value = nested_fields[name].get_natural_key(value)
+                    obj = nested_objs[name][value]
+                    key.append(value)
+                    row.append(obj.pk if obj else None)
+                else:
+                    key.append(value)
+                    row.append(value)
+            if None in key:
+                # Ignore validation if any field is None
+                rows.append((None, None))
+            elif None in row:
+                # Nested object does not exist yet, so this one can't either
+                rows.append((tuple(key), None))
+            else:
+                rows.append((tuple(key), tuple(row)))
+
+        attnames = [
+            model_class._meta.get_field(source).attname for source in sources
+        ]
+        lookups = list({row for key, row in rows if row is not None})
+        existing = set()
+        for chunk in chunk_lookups(queryset.db, lookups, len(attnames)):
+            existing.update(
+                queryset.filter(
+                    natural_key_lookup_q(attnames, chunk, queryset.db)
+                )
+                .values_list(*attnames)
+                .distinct()
+            )
+
+        message = self.message.format(field_names=", ".join(self.fields))
+        errors = []
+        seen = set()
+        for key, row in rows:
+            if key is None:
+                errors.append(None)
+            elif row in existing or key in seen:
+                errors.append(message)
+            else:
+                errors.append(None)
+            seen.add(key)
+        return errors
+
+    def get_nested_pk(self, model_class, values):
+        paths = model_class.get_natural_key_paths()
+        if all(len(path) == 1 for path in paths.values()):
+            natural_key = tuple(values.get(field) for field in paths)
+        else:
+            natural_key = None
+
+        using = model_class._default_manager.db
+        result = model_class._default_manager.filter(**values)
+        if natural_key is not None:
+            cached_pks = get_cached_pks(model_class, using, [natural_key])
+            if natural_key in cached_pks:
+                # Check that the cached pk still has the natural key
+                pk = cached_pks[natural_key]
+                if result.filter(pk=pk).exists():
+                    return pk
+
+        pks = list(result.values_list("pk", flat=True)[:1])
+        if not pks:
+            return None
+        pk = pks[0]
+        if natural_key is not None:
+            set_cached_pks(model_class, using, {natural_key: pk})
+        return pk
+
+
+class NaturalKeyListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer that resolves the natural keys for all items at once.
+    Items (and any missing nested objects) are then created with the child
+    serializer's create() and find(), or with bulk_create() if the child's
+    Meta sets bulk_create = True.
+    """
+
+    def to_internal_value(self, data):
+        validated_data = super(
+            NaturalKeyListSerializer, self
+        ).to_internal_value(data)
+        errors = [{} for item in validated_data]
+        for validator in self.child.validators:
+            if not isinstance(validator, NaturalKeyValidator):
+                continue
+            messages = validator.validate_batch(validated_data, self.child)
+            for error, message in zip(errors, messages):
+                if message:
+                    error.setdefault(
+                        api_settings.NON_FIELD_ERRORS_KEY, []
+                    ).append(ErrorDetail(message, code="unique"))
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated_data
+
+    def create(self, validated_data):
+        with record_operation(self.child.Meta.model, "serializer_bulk_create"):
+            return self._create(validated_data)
+
+    def _create(self, validated_data):
+        if isinstance(self.child, NaturalKeySerializer):
+            if type(self.child).create is not NaturalKeySerializer.create:
+                return [self.child.create(attrs) for attrs in validated_data]
+            keys = [
+                self.child.get_natural_key(attrs) for attrs in validated_data
+            ]
+            objs = get_or_create_by_natural_keys(
+                self.child.Meta.model,
+                keys,
+                getattr(self.child.Meta, "bulk_create", False),
+            )
+            return [objs[key] for key in keys]
+
+        self.child.bulk_convert_natural_keys(validated_data)
+        if self.can_bulk_create(validated_data):
+            model_class = self.child.Meta.model
+            return model_class._default_manager.bulk_create(
+                [model_class(**attrs) for attrs in validated_data]
+            )
+        return [self.child.create(attrs) for attrs in validated_data]
+
+    def can_bulk_create(self, validated_data):
+        """
+        Whether the items can be created with bulk_create().  Since this
+        skips Model.save() and the pre_save/post_save signals, it must be
+        enabled via Meta.bulk_create on the child serializer.  Serializers
+        that override create(), multi-table inherited models, and items with
+        many-to-many values are always created one at a time.
+        """
+        if not getattr(self.child.Meta, "bulk_create", False):
+            return False
+        if type(self.child).create is not NaturalKeyModelSerializer.create:
+            return False
+        model_class = self.child.Meta.model
+        if model_class._meta.parents:
+            return False
+        manager = model_class._default_manager
+        if not connections[
+            manager.db
+        ].features.can_return_rows_from_bulk_insert:
+            return False
+        info = model_meta.get_field_info(model_class)
+        many_to_many = [
+            name
+            for name, relation_info in info.relations.items()
+            if relation_info.to_many
+        ]
+        return not any(
+            name in attrs for attrs in validated_data for name in many_to_many
+        )
+
 
 class NaturalKeySerializer(JSONFormModelSerializer):
     """
@@ -70,6 +328,16 @@ class NaturalKeySerializer(JSONFormModelSerializer):
             ]
         return field_class, field_kwargs
 
+    def get_fields(self):
+        # Natural key fields only depend on the model, so they are built once
+        # per class and then copied (as DRF does for declared fields)
+        serializer_class = type(self)
+        if serializer_class not in _natural_key_fields:
+            _natural_key_fields[serializer_class] = super(
+                NaturalKeySerializer, self
+            ).get_fields()
+        return copy.deepcopy(_natural_key_fields[serializer_class])
+
     def build_nested_field(self, field_name, relation_info, nested_depth):
         field_class = NaturalKeySerializer.for_model(
             relation_info.related_model,
@@ -80,14 +348,13 @@ class NaturalKeySerializer(JSONFormModelSerializer):
 
     def create(self, validated_data):
         model_class = self.Meta.model
-        natural_key_fields = model_class.get_natural_key_fields()
-        natural_key = []
-        for field in natural_key_fields:
-            val = validated_data
-            for key in field.split("__"):
-                val = val[key]
-            natural_key.append(val)
-        return model_class.objects.find(*natural_key)
+        with record_operation(model_class, "serializer_create"):
+            return model_class.objects.find(
+                *self.get_natural_key(validated_data)
+            )
+
+    def get_natural_key(self, validated_data):
+        return get_natural_key(self.Meta.model, validated_data)
 
     def update(self, instance, validated_data):
         raise NotImplementedError(
@@ -96,6 +363,15 @@ class NaturalKeySerializer(JSONFormModelSerializer):
 
     @classmethod
     def for_model(cls, model_class, validate_key=True, include_fields=None):
+        return get_serializer_class(
+            cls,
+            model_class,
+            validate_key=validate_key,
+            include_fields=include_fields,
+        )
+
+    @classmethod
+    def _build_for_model(cls, model_class, validate_key, include_fields):
         unique_together = model_class.get_natural_key_def()
         if include_fields and list(include_fields) != list(unique_together):
             raise NotImplementedError(
@@ -130,6 +406,7 @@ class NaturalKeySerializer(JSONFormModelSerializer):
 
     class Meta:
         depth = 1
+        list_serializer_class = NaturalKeyListSerializer
 
 
 class NaturalKeyModelSerializer(JSONFormModelSerializer):
@@ -137,6 +414,13 @@ class NaturalKeyModelSerializer(JSONFormModelSerializer):
     Serializer for models with one or more foreign keys to a NaturalKeyModel
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Resolve natural keys in bulk for many=True, unless overridden
+        meta = getattr(cls, "Meta", None)
+        if meta and not hasattr(meta, "list_serializer_class"):
+            meta.list_serializer_class = NaturalKeyListSerializer
+
     def is_natural_key_model(self, related_model):
         return issubclass(related_model, NaturalKeyModel)
 
@@ -184,8 +468,11 @@ class NaturalKeyModelSerializer(JSONFormModelSerializer):
         return fields
 
     def create(self, validated_data):
-        self.convert_natural_keys(validated_data)
-        return super(NaturalKeyModelSerializer, self).create(validated_data)
+        with record_operation(self.Meta.model, "serializer_create"):
+            self.convert_natural_keys(validated_data)
+            return super(NaturalKeyModelSerializer, self).create(
+                validated_data
+            )
 
     def update(self, instance, validated_data):
         self.convert_natural_keys(validated_data)
@@ -193,18 +480,78 @@ class NaturalKeyModelSerializer(JSONFormModelSerializer):
             instance, validated_data
         )
 
+    def get_natural_key_plan(self):
+        """
+        List the (name, field) for each nested natural key field.  The names
+        of candidate fields are computed once per serializer class (from the
+        declared fields and the model), then filtered against this instance's
+        fields, which may differ (e.g. if __init__ removes a field).
+        """
+        serializer_class = type(self)
+        if serializer_class not in _natural_key_plans:
+            names = [
+                name
+                for name, field in self._declared_fields.items()
+                if isinstance(field, NaturalKeySerializer)
+            ]
+            names += [
+                name
+                for name in self.build_natural_key_fields()
+                if name not in names
+            ]
+            _natural_key_plans[serializer_class] = names
+        fields = self.fields
+        return [
+            (name, fields[name])
+            for name in _natural_key_plans[serializer_class]
+            if isinstance(fields.get(name), NaturalKeySerializer)
+        ]
+
     def convert_natural_keys(self, validated_data):
-        fields = self.get_fields()
-        for name, field in fields.items():
-            if name not in validated_data:
+        for name, field in self.get_natural_key_plan():
+            value = validated_data.get(field.source)
+            if value is None or isinstance(value, field.Meta.model):
+                # Missing, or already converted by bulk_convert_natural_keys()
                 continue
-            if isinstance(field, NaturalKeySerializer):
-                validated_data[name] = fields[name].create(
-                    validated_data[name]
-                )
+            validated_data[field.source] = field.create(value)
+
+    def bulk_convert_natural_keys(self, validated_data_list):
+        """
+        Resolve the nested natural keys for a list of items in bulk (see
+        get_or_create_by_natural_keys()).  Missing nested objects are created
+        with bulk_create() only if Meta.bulk_create is set.
+        """
+        bulk_create = getattr(self.Meta, "bulk_create", False)
+        for name, field in self.get_natural_key_plan():
+            source = field.source
+            items = [
+                validated_data
+                for validated_data in validated_data_list
+                if validated_data.get(source) is not None
+            ]
+            if type(field).create is not NaturalKeySerializer.create:
+                # Respect overridden create() methods
+                for item in items:
+                    item[source] = field.create(item[source])
+                continue
+            model_class = field.Meta.model
+            keys = [field.get_natural_key(item[source]) for item in items]
+            if not keys:
+                continue
+            objs = get_or_create_by_natural_keys(
+                model_class, keys, bulk_create
+            )
+            for item, key in zip(items, keys):
+                item[source] = objs[key]
 
     @classmethod
     def for_model(cls, model_class, include_fields=None):
+        return get_serializer_class(
+            cls, model_class, include_fields=include_fields
+        )
+
+    @classmethod
+    def _build_for_model(cls, model_class, include_fields):
         # c.f. wq.db.rest.serializers.ModelSerializer
         class Serializer(cls):
             class Meta(cls.Meta):
@@ -215,4 +562,4 @@ class NaturalKeyModelSerializer(JSONFormModelSerializer):
         return Serializer
 
     class Meta:
-        pass
+        list_serializer_class = NaturalKeyListSerializer
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils import timezone
+
+
+class NaturalKeySlugCodec:
+    """
+    Convert natural keys to and from slugs for a model.  Each value is
+    validated and converted with the corresponding model field's
+    to_python(), so that invalid slugs can be rejected without a query.
+
+    If escape is set, separators (and escape characters) within values are
+    prefixed with it.  Otherwise, any extra separators are assumed to be part
+    of the last value.
+    """
+
+    def __init__(self, fields, separator="-", escape=None):
+        self.fields = list(fields)
+        self.separator = separator
+        self.escape = escape
+        self.converters = [get_converter(field) for field in self.fields]
+
+    def encode(self, natural_key):
+        """
+        Return the slug for the given natural key values.
+        """
+        values = [str(value) for value in natural_key]
+        if self.escape:
+            values = [self.escape_value(value) for value in values]
+        return self.separator.join(values)
+
+    def decode(self, slug):
+        """
+        Return the natural key values for the given slug, or None if the slug
+        is not valid.
+        """
+        if self.escape:
+            parts = self.split_escaped(slug)
+        else:
+            parts = slug.split(self.separator)
+        count = len(self.converters)
+        if len(parts) < count:
+            return None
+        if len(parts) > count:
+            parts[count - 1 :] = [self.separator.join(parts[count - 1 :])]
+        return self.to_python(parts)
+
+    def to_python(self, values):
+        """
+        Convert natural key values to the natural key field types, or return
+        None if any value is not valid.  (None values are left as is.)
+        """
+        try:
+            return [
+                value if value is None else convert(value)
+                for convert, value in zip(self.converters, values)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            return None
+
+    def escape_value(self, value):
+        return value.replace(self.escape, self.escape * 2).replace(
+            self.separator, self.escape + self.separator
+        )
+
+    def split_escaped(self, slug):
+        escape, separator = self.escape, self.separator
+        parts = []
+        current = []
+        i = 0
+        while i < len(slug):
+            if slug.startswith(escape * 2, i):
+                current.append(escape)
+                i += len(escape) * 2
+            elif slug.startswith(escape + separator, i):
+                current.append(separator)
+                i += len(escape) + len(separator)
+            elif slug.startswith(separator, i):
+                parts.append("".join(current))
+                current = []
+                i += len(separator)
+            else:
+                current.append(slug[i])
+                i += 1
+        parts.append("".join(current))
+        return parts
+
+
+def get_path_field(model, parts):
+    """
+    Return the field at the end of a "__"-separated natural key path.
+    """
+    for part in parts[:-1]:
+        model = model._meta.get_field(part).related_model
+    return model._meta.get_field(parts[-1])
+
+
+def get_converter(field):
+    """
+    Return a function that converts values for the given field to match the
+    values read back from the database.  (Like DateTimeField.get_prep_value(),
+    naive datetimes are made aware when USE_TZ is enabled.)
+    """
+    if not isinstance(field, models.DateTimeField):
+        return field.to_python
+
+    def convert(value):
+        value = field.to_python(value)
+        if value is not None and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    return convert
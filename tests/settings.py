@@ -11,5 +11,6 @@ REST_FRAMEWORK = {
 }
 
 INSTALLED_APPS = [
+    "natural_keys",
     "tests.test_app",
 ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("test_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ModelWithDateTime",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.CharField(max_length=10)),
+                ("timestamp", models.DateTimeField()),
+            ],
+            options={
+                "unique_together": {("code", "timestamp")},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("test_app", "0002_modelwithdatetime"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ModelWithInheritedKey",
+            fields=[
+                (
+                    "modelwithsingleuniquefield_ptr",
+                    models.OneToOneField(
+                        auto_created=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        parent_link=True,
+                        primary_key=True,
+                        serialize=False,
+                        to="test_app.modelwithsingleuniquefield",
+                    ),
+                ),
+                ("extra", models.CharField(blank=True, max_length=10)),
+            ],
+            options={
+                "abstract": False,
+            },
+            bases=("test_app.modelwithsingleuniquefield",),
+        ),
+    ]
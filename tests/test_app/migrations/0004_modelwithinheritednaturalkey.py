@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("test_app", "0003_modelwithinheritedkey"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ModelWithInheritedNaturalKey",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("value", models.CharField(max_length=10)),
+                (
+                    "key",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="test_app.modelwithinheritedkey",
+                    ),
+                ),
+            ],
+        ),
+    ]
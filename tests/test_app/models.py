@@ -55,3 +55,20 @@ class ModelWithConstraint(NaturalKeyModel):
                 fields=["code", "date"],
             ),
         ]
+
+
+class ModelWithDateTime(NaturalKeyModel):
+    code = models.CharField(max_length=10)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        unique_together = ["code", "timestamp"]
+
+
+class ModelWithInheritedKey(ModelWithSingleUniqueField):
+    extra = models.CharField(max_length=10, blank=True)
+
+
+class ModelWithInheritedNaturalKey(models.Model):
+    key = models.ForeignKey(ModelWithInheritedKey, on_delete=models.CASCADE)
+    value = models.CharField(max_length=10)
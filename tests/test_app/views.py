@@ -37,6 +37,6 @@ else:
             fields = "__all__"
 
     class NaturalKeyLookupViewSet(viewsets.ModelViewSet):
-        queryset = NaturalKeyChild.objects.all()
+        queryset = NaturalKeyChild.objects.with_natural_keys()
         serializer_class = LookupSerializer
         lookup_field = "natural_key_slug"
@@ -0,0 +1,250 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache as default_cache
+from django.db import transaction
+from tests.test_app.models import NaturalKeyParent, NaturalKeyChild
+from natural_keys import NaturalKeyCache, cache_natural_keys
+from natural_keys.cache import get_cached_pks
+from unittest import mock
+from weakref import WeakSet
+
+# Tests for natural key lookup caching
+
+
+class NaturalKeyCacheTestCase(TestCase):
+    def setUp(self):
+        self.child = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        NaturalKeyChild.objects.find("code1", "group1", "mode2")
+
+    def test_cache_natural_keys(self):
+        with cache_natural_keys() as cache:
+            # Nested parent lookup is cached as well
+            with self.assertNumQueries(2):
+                child = NaturalKeyChild.objects.get_by_natural_key(
+                    "code1", "group1", "mode1"
+                )
+            with self.assertNumQueries(0):
+                self.assertIs(
+                    NaturalKeyChild.objects.get_by_natural_key(
+                        "code1", "group1", "mode1"
+                    ),
+                    child,
+                )
+            with self.assertNumQueries(1):
+                NaturalKeyChild.objects.get_by_natural_key(
+                    "code1", "group1", "mode2"
+                )
+        self.assertEqual(child, self.child)
+        self.assertEqual(cache.cache_info(), (2, 3, 1024, 3))
+
+        # Cache is no longer active
+        with self.assertNumQueries(2):
+            NaturalKeyChild.objects.get_by_natural_key(
+                "code1", "group1", "mode1"
+            )
+
+    def test_cache_eviction(self):
+        with cache_natural_keys(maxsize=1) as cache:
+            NaturalKeyParent.objects.get_by_natural_key("code1", "group1")
+            NaturalKeyChild.objects.get_by_natural_key(
+                "code1", "group1", "mode2"
+            )
+            self.assertEqual(cache.cache_info().currsize, 1)
+            with self.assertNumQueries(1):
+                NaturalKeyParent.objects.get_by_natural_key("code1", "group1")
+
+        with cache_natural_keys(timeout=60) as cache:
+            NaturalKeyParent.objects.get_by_natural_key("code1", "group1")
+            with mock.patch("time.monotonic", return_value=1e12):
+                with self.assertNumQueries(1):
+                    NaturalKeyParent.objects.get_by_natural_key(
+                        "code1", "group1"
+                    )
+            self.assertEqual(cache.misses, 2)
+
+    def test_cache_invalidation(self):
+        with cache_natural_keys() as cache:
+            parent = NaturalKeyParent.objects.get_by_natural_key(
+                "code1", "group1"
+            )
+            NaturalKeyChild.objects.get_by_natural_key(
+                "code1", "group1", "mode1"
+            )
+            self.assertEqual(cache.cache_info().currsize, 2)
+
+            # Renaming the parent changes the child's natural key too
+            parent.code = "code2"
+            parent.save()
+            self.assertEqual(cache.cache_info().currsize, 0)
+            with self.assertRaises(NaturalKeyChild.DoesNotExist):
+                NaturalKeyChild.objects.get_by_natural_key(
+                    "code1", "group1", "mode1"
+                )
+
+            child = NaturalKeyChild.objects.get_by_natural_key(
+                "code2", "group1", "mode1"
+            )
+            child.delete()
+            with self.assertRaises(NaturalKeyChild.DoesNotExist):
+                NaturalKeyChild.objects.get_by_natural_key(
+                    "code2", "group1", "mode1"
+                )
+
+    def test_natural_key_state(self):
+        # The loaded natural key is only tracked if caching is in use
+        with mock.patch("natural_keys.cache._caches", WeakSet()):
+            parent = NaturalKeyParent.objects.get()
+            self.assertFalse(hasattr(parent, "_natural_key_state"))
+        with cache_natural_keys():
+            parent = NaturalKeyParent.objects.get()
+            self.assertEqual(parent._natural_key_state, ("code1", "group1"))
+
+
+class ManagerCacheTestCase(TransactionTestCase):
+    # The manager's cache is only written outside of transactions, so these
+    # tests can't run within TestCase's atomic block
+
+    def setUp(self):
+        NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        self.addCleanup(setattr, NaturalKeyChild.objects, "cache", None)
+        self.addCleanup(setattr, NaturalKeyParent.objects, "cache", None)
+
+    def test_manager_cache(self):
+        manager = NaturalKeyChild.objects
+        self.assertIsNone(manager.cache)
+        manager.cache = NaturalKeyCache()
+        with self.assertNumQueries(2):
+            manager.find("code1", "group1", "mode1")
+            manager.find("code1", "group1", "mode1")
+        self.assertEqual(manager.cache.cache_info().hits, 1)
+
+        # Existing entries are still used within transactions
+        with transaction.atomic():
+            with self.assertNumQueries(0):
+                manager.find("code1", "group1", "mode1")
+
+    def test_manager_cache_rollback(self):
+        manager = NaturalKeyParent.objects
+        manager.cache = NaturalKeyCache()
+        with transaction.atomic():
+            obj = manager.create(code="a", group="g")
+            self.assertEqual(manager.get_by_natural_key("a", "g"), obj)
+            transaction.set_rollback(True)
+
+        # The rolled back object was not cached
+        self.assertEqual(manager.cache.cache_info().currsize, 0)
+        with self.assertRaises(NaturalKeyParent.DoesNotExist):
+            manager.get_by_natural_key("a", "g")
+        child = NaturalKeyChild.objects.find("a", "g", "mode1")
+        self.assertEqual(child.parent.natural_key(), ("a", "g"))
+
+
+@override_settings(NATURAL_KEYS_CACHE="default")
+class SharedCacheTestCase(TestCase):
+    def setUp(self):
+        default_cache.clear()
+        self.child = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        default_cache.clear()
+
+    def test_shared_cache(self):
+        key = ("code1", "group1", "mode1")
+        with self.assertNumQueries(2):
+            NaturalKeyChild.objects.get_by_natural_key(*key)
+
+        # Subsequent lookups only need to fetch by pk
+        with self.assertNumQueries(1):
+            child = NaturalKeyChild.objects.get_by_natural_key(*key)
+        self.assertEqual(child, self.child)
+
+        # Only the primary key is stored
+        self.assertEqual(
+            get_cached_pks(NaturalKeyChild, "default", [key]),
+            {key: child.pk},
+        )
+
+        # Saving without changing the natural key keeps the cache
+        child.parent.save()
+        with self.assertNumQueries(1):
+            NaturalKeyChild.objects.get_by_natural_key(*key)
+
+        # Changing the parent's key invalidates the child (via a version bump)
+        child.parent.code = "code2"
+        child.parent.save()
+        with self.assertNumQueries(1):
+            with self.assertRaises(NaturalKeyChild.DoesNotExist):
+                NaturalKeyChild.objects.get_by_natural_key(*key)
+
+    def test_shared_cache_rollback(self):
+        with transaction.atomic():
+            obj = NaturalKeyParent.objects.create(code="a", group="g")
+            self.assertEqual(
+                NaturalKeyParent.objects.get_by_natural_key("a", "g"), obj
+            )
+            self.assertEqual(
+                NaturalKeyParent.objects.resolve_keys([("a", "g")], bulk=True),
+                ({("a", "g"): obj}, True),
+            )
+            transaction.set_rollback(True)
+
+        # The stale cached pk may be reused, but must not match
+        NaturalKeyParent.objects.create(pk=obj.pk, code="b", group="g")
+        with self.assertRaises(NaturalKeyParent.DoesNotExist):
+            NaturalKeyParent.objects.get_by_natural_key("a", "g")
+        self.assertEqual(
+            NaturalKeyParent.objects.resolve_keys([("a", "g")], bulk=True),
+            ({("a", "g"): None}, False),
+        )
+
+    def test_shared_cache_rollback_natural_key_pks(self):
+        key = ("a", "g")
+        manager = NaturalKeyParent.objects
+        with transaction.atomic():
+            obj = manager.create(code="a", group="g")
+            self.assertEqual(manager.natural_key_pks([key]), {key: obj.pk})
+            transaction.set_rollback(True)
+
+        # The stale cached pk may be reused, but must not match
+        manager.create(pk=obj.pk, code="b", group="g")
+        self.assertEqual(manager.natural_key_pks([key]), {})
+        self.assertEqual(manager.missing_natural_keys([key]), {key})
+
+        # Valid cached pks are checked with a single query
+        obj = manager.create(code="a", group="g")
+        self.assertEqual(manager.natural_key_pks([key]), {key: obj.pk})
+        with self.assertNumQueries(1):
+            self.assertEqual(manager.natural_key_pks([key]), {key: obj.pk})
+
+    def test_shared_cache_resolve_keys(self):
+        keys = [("code1", "group1", "mode1"), ("code1", "group1", "mode2")]
+        resolved, success = NaturalKeyChild.objects.resolve_keys(
+            keys, bulk=True
+        )
+        self.assertFalse(success)
+
+        # Cached key is fetched by matching (pk, *natural key), the other
+        # is looked up
+        with self.assertNumQueries(3):
+            resolved, success = NaturalKeyChild.objects.resolve_keys(
+                keys, bulk=True
+            )
+        self.assertEqual(resolved, {keys[0]: self.child, keys[1]: None})
+
+        with self.assertNumQueries(1):
+            resolved, success = NaturalKeyChild.objects.resolve_keys(
+                keys[:1], bulk=True
+            )
+        self.assertEqual(resolved, {keys[0]: self.child})
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+            }
+        }
+    )
+    def test_dummy_cache(self):
+        key = ("code1", "group1", "mode1")
+        for i in range(2):
+            with self.assertNumQueries(2):
+                child = NaturalKeyChild.objects.get_by_natural_key(*key)
+        self.assertEqual(child, self.child)
+        child.parent.save()
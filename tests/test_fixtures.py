@@ -0,0 +1,254 @@
+from django.test import TestCase, override_settings
+from django.core.cache import cache as default_cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from tests.test_app.models import (
+    NaturalKeyParent,
+    NaturalKeyChild,
+    ModelWithNaturalKey,
+    ModelWithExtraField,
+    ModelWithDateTime,
+)
+from natural_keys import cache_natural_keys
+from natural_keys.cache import get_cached_pks
+from natural_keys.fixtures import (
+    iter_json_objects,
+    load_fixture,
+    dump_fixture,
+)
+from datetime import date
+import io
+import json
+import os
+import tempfile
+
+# Tests for streaming natural key fixtures
+
+
+class FixtureTestCase(TestCase):
+    def write_fixture(self, content, suffix=".json"):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_iter_json_objects(self):
+        objects = [{"id": i, "text": "a, b ] [ {c}" * i} for i in range(5)]
+        array = json.dumps(objects, indent=2)
+        lines = "\n".join(json.dumps(obj) for obj in objects) + "\n"
+        for content in array, lines, "[]", "":
+            expected = objects if len(content) > 2 else []
+            self.assertEqual(
+                list(iter_json_objects(io.StringIO(content), chunk_size=7)),
+                expected,
+            )
+
+    def test_loadnaturalkeys(self):
+        NaturalKeyParent.objects.find("code0", "group0")
+        objects = [
+            {
+                "model": "test_app.naturalkeyparent",
+                "fields": {"code": "code%s" % i, "group": "group1"},
+            }
+            for i in range(5)
+        ]
+        objects += [
+            {
+                "model": "test_app.naturalkeychild",
+                "fields": {
+                    "parent": ["code%s" % (i % 5), "group1"],
+                    "mode": "mode%s" % i,
+                },
+            }
+            for i in range(10)
+        ]
+        objects.append(
+            {
+                "model": "test_app.modelwithnaturalkey",
+                "pk": 7,
+                "fields": {"key": ["code3", "group1", "mode8"], "value": 8},
+            }
+        )
+        path = self.write_fixture(json.dumps(objects))
+        out = io.StringIO()
+        call_command("loadnaturalkeys", path, stdout=out)
+        self.assertEqual(
+            out.getvalue().strip(), "Installed 16 object(s) from 1 fixture(s)"
+        )
+        self.assertEqual(NaturalKeyParent.objects.count(), 6)
+        self.assertEqual(NaturalKeyChild.objects.count(), 10)
+        obj = ModelWithNaturalKey.objects.get(pk=7)
+        self.assertEqual(obj.key.natural_key(), ("code3", "group1", "mode8"))
+
+        # Reloading updates the existing objects (matched by natural key)
+        objects[-1]["fields"]["value"] = 9
+        path = self.write_fixture(
+            "\n".join(json.dumps(obj) for obj in objects), ".jsonl"
+        )
+        call_command("loadnaturalkeys", path, verbosity=0)
+        self.assertEqual(NaturalKeyChild.objects.count(), 10)
+        self.assertEqual(ModelWithNaturalKey.objects.get(pk=7).value, "9")
+
+    def test_load_fixture_batches(self):
+        ModelWithExtraField.objects.find(
+            "code1", "2019-07-26", defaults={"extra": "old"}
+        )
+        objects = [
+            {
+                "model": "test_app.modelwithextrafield",
+                "fields": {
+                    "code": "code%s" % i,
+                    "date": "2019-07-26",
+                    "extra": "new",
+                },
+            }
+            for i in range(50)
+        ]
+        # Savepoint + release, plus per batch: look up existing rows, then
+        # insert (and update, for the batch with an existing row)
+        with self.assertNumQueries(2 + 3 + 2):
+            count = load_fixture(
+                io.StringIO(json.dumps(objects)), batch_size=25
+            )
+        self.assertEqual(count, 50)
+        self.assertEqual(ModelWithExtraField.objects.count(), 50)
+        obj = ModelWithExtraField.objects.get_by_natural_key(
+            "code1", date(2019, 7, 26)
+        )
+        self.assertEqual(obj.extra, "new")
+
+    @override_settings(NATURAL_KEYS_CACHE="default")
+    def test_load_fixture_invalidates_caches(self):
+        default_cache.clear()
+        parent = NaturalKeyParent.objects.find("code1", "group1")
+        NaturalKeyParent.objects.get_by_natural_key("code1", "group1")
+        self.assertEqual(
+            get_cached_pks(NaturalKeyParent, "default", [("code1", "group1")]),
+            {("code1", "group1"): parent.pk},
+        )
+        obj = ModelWithExtraField.objects.find(
+            "code1", "2019-07-26", defaults={"extra": "old"}
+        )
+        objects = [
+            {
+                "model": "test_app.naturalkeyparent",
+                "pk": parent.pk,
+                "fields": {"code": "code2", "group": "group1"},
+            },
+            {
+                "model": "test_app.modelwithextrafield",
+                "fields": {
+                    "code": "code1",
+                    "date": "2019-07-26",
+                    "extra": "new",
+                },
+            },
+        ]
+        with cache_natural_keys():
+            ModelWithExtraField.objects.get_by_natural_key(
+                "code1", "2019-07-26"
+            )
+            load_fixture(io.StringIO(json.dumps(objects)))
+            obj = ModelWithExtraField.objects.get_by_natural_key(
+                "code1", "2019-07-26"
+            )
+        self.assertEqual(obj.extra, "new")
+
+        # Changing a natural key by pk bumps the shared cache version
+        self.assertEqual(
+            get_cached_pks(NaturalKeyParent, "default", [("code1", "group1")]),
+            {},
+        )
+        with self.assertRaises(NaturalKeyParent.DoesNotExist):
+            NaturalKeyParent.objects.get_by_natural_key("code1", "group1")
+
+    @override_settings(USE_TZ=True)
+    def test_load_fixture_datetime(self):
+        objects = [
+            {
+                "model": "test_app.modelwithdatetime",
+                "fields": {"code": "a", "timestamp": "2020-01-01 00:00:00"},
+            }
+        ]
+        for i in range(2):
+            load_fixture(io.StringIO(json.dumps(objects)))
+        self.assertEqual(ModelWithDateTime.objects.count(), 1)
+
+    def test_loadnaturalkeys_missing(self):
+        path = self.write_fixture(
+            json.dumps(
+                [
+                    {
+                        "model": "test_app.naturalkeychild",
+                        "fields": {"parent": ["code1", "group1"], "mode": "m"},
+                    }
+                ]
+            )
+        )
+        with self.assertRaises(CommandError) as e:
+            call_command("loadnaturalkeys", path, verbosity=0)
+        self.assertIn("does not exist", str(e.exception))
+        self.assertFalse(NaturalKeyChild.objects.exists())
+
+    def test_dumpnaturalkeys(self):
+        for i in range(5):
+            child = NaturalKeyChild.objects.find("code%s" % i, "group1", "m")
+            ModelWithNaturalKey.objects.create(key=child, value=i)
+        NaturalKeyChild.objects.create(mode="orphan")
+
+        out = io.StringIO()
+        call_command("dumpnaturalkeys", "test_app", stdout=out)
+        objects = list(iter_json_objects(io.StringIO(out.getvalue())))
+        self.assertEqual(len(objects), 16)
+
+        # Parents come first, and natural keys replace primary keys
+        models = [obj["model"] for obj in objects]
+        self.assertLess(
+            max(i for i, m in enumerate(models) if m.endswith("parent")),
+            min(i for i, m in enumerate(models) if m.endswith("child")),
+        )
+        self.assertIn(
+            {
+                "model": "test_app.naturalkeychild",
+                "fields": {"parent": ["code1", "group1"], "mode": "m"},
+            },
+            objects,
+        )
+        self.assertIn(
+            {
+                "model": "test_app.naturalkeychild",
+                "fields": {"parent": None, "mode": "orphan"},
+            },
+            objects,
+        )
+        obj = ModelWithNaturalKey.objects.get(value="2")
+        self.assertIn(
+            {
+                "model": "test_app.modelwithnaturalkey",
+                "pk": obj.pk,
+                "fields": {"key": ["code2", "group1", "m"], "value": "2"},
+            },
+            objects,
+        )
+
+        # Round trip
+        ModelWithNaturalKey.objects.all().delete()
+        NaturalKeyChild.objects.all().delete()
+        NaturalKeyParent.objects.all().delete()
+        load_fixture(io.StringIO(out.getvalue()))
+        obj = ModelWithNaturalKey.objects.get(pk=obj.pk)
+        self.assertEqual(obj.key.natural_key(), ("code2", "group1", "m"))
+        self.assertEqual(NaturalKeyChild.objects.count(), 6)
+
+    def test_dump_fixture_queries(self):
+        for i in range(10):
+            NaturalKeyChild.objects.find("code%s" % i, "group1", "m")
+        out = io.StringIO()
+        # One (streamed) query per model, regardless of natural key depth
+        with self.assertNumQueries(2):
+            count = dump_fixture(
+                out, [NaturalKeyChild, NaturalKeyParent], chunk_size=4
+            )
+        self.assertEqual(count, 20)
+        self.assertEqual(len(out.getvalue().splitlines()), 20)
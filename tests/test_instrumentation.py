@@ -0,0 +1,66 @@
+from django.test import TestCase
+from tests.test_app.models import NaturalKeyParent, NaturalKeyChild
+from natural_keys import track_natural_keys
+
+# Tests for natural key instrumentation
+
+
+class InstrumentationTestCase(TestCase):
+    def test_track_natural_keys(self):
+        records = []
+        with track_natural_keys(callback=records.append) as tracker:
+            NaturalKeyChild.objects.find("code1", "group1", "mode1")
+            NaturalKeyChild.objects.get_by_natural_key(
+                "code1", "group1", "mode1"
+            )
+        summary = tracker.summary()
+
+        child = summary[("test_app.NaturalKeyChild", "get_by_natural_key")]
+        self.assertEqual(child.count, 2)
+        # Nested lookups run within get_or_create_by_natural_key
+        self.assertEqual(child.max_depth, 1)
+        parent = summary[("test_app.NaturalKeyParent", "get_by_natural_key")]
+        self.assertEqual(parent.count, 3)
+        self.assertEqual(parent.max_depth, 3)
+
+        find = summary[
+            ("test_app.NaturalKeyChild", "get_or_create_by_natural_key")
+        ]
+        self.assertEqual(find.count, 1)
+        self.assertEqual(find.max_depth, 0)
+        # Includes the nested lookups and savepoints
+        self.assertGreaterEqual(find.queries, 4)
+        self.assertEqual(
+            sum(record.queries for record in records if record.depth == 0),
+            tracker.queries,
+        )
+        self.assertGreaterEqual(find.duration, 0)
+
+        self.assertEqual(len(records), sum(s.count for s in summary.values()))
+        self.assertEqual(records[-1].model, NaturalKeyChild)
+        self.assertEqual(records[-1].operation, "get_by_natural_key")
+        self.assertEqual(records[-1].depth, 0)
+        self.assertEqual(records[-1].queries, 2)
+
+    def test_resolve_keys(self):
+        NaturalKeyParent.objects.find("code1", "group1")
+        with track_natural_keys() as tracker:
+            NaturalKeyChild.objects.resolve_keys(
+                [("code1", "group1", "mode1")], auto_create=True, bulk=True
+            )
+        summary = tracker.summary()
+        self.assertEqual(
+            summary[("test_app.NaturalKeyChild", "resolve_keys")].queries,
+            tracker.queries,
+        )
+        self.assertIn(
+            ("test_app.NaturalKeyParent", "bulk_get_or_create_by_natural_key"),
+            summary,
+        )
+
+    def test_inactive(self):
+        with track_natural_keys() as tracker:
+            pass
+        NaturalKeyParent.objects.find("code1", "group1")
+        self.assertEqual(tracker.summary(), {})
+        self.assertEqual(tracker.queries, 0)
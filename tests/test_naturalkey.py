@@ -1,12 +1,21 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from tests.test_app.models import (
     NaturalKeyParent,
     NaturalKeyChild,
     ModelWithSingleUniqueField,
     ModelWithExtraField,
     ModelWithConstraint,
+    ModelWithDateTime,
+    ModelWithInheritedKey,
 )
+from django.db import connection
 from django.db.utils import IntegrityError
+from datetime import date, datetime
+from decimal import Decimal
+from natural_keys import NaturalKeyModelManager, cache_natural_keys
+from natural_keys.models import NaturalKeyQuerySet, clear_natural_key_cache
+from unittest import mock
 
 # Tests for natural key models
 
@@ -126,3 +135,771 @@ class NaturalKeyTestCase(TestCase):
             ),
             obj,
         )
+
+    def test_resolve_keys_bulk(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.find("code1", "group1", "mode2")
+        c3 = NaturalKeyChild.objects.find("code2", "group2", "mode1")
+        c4 = NaturalKeyChild.objects.create(mode="mode0")
+        keys = [
+            ("code1", "group1", "mode1"),
+            ("code1", "group1", "mode2"),
+            ("code2", "group2", "mode1"),
+            ("code2", "group2", "mode3"),
+            ("code3", "group3", "mode1"),
+            (None, None, "mode0"),
+        ]
+
+        # One query for the parents, one for the children
+        with self.assertNumQueries(2):
+            resolved, success = NaturalKeyChild.objects.resolve_keys(
+                keys, bulk=True
+            )
+        self.assertFalse(success)
+        self.assertEqual(
+            resolved,
+            {
+                ("code1", "group1", "mode1"): c1,
+                ("code1", "group1", "mode2"): c2,
+                ("code2", "group2", "mode1"): c3,
+                ("code2", "group2", "mode3"): None,
+                ("code3", "group3", "mode1"): None,
+                (None, None, "mode0"): c4,
+            },
+        )
+        self.assertEqual(
+            resolved, NaturalKeyChild.objects.resolve_keys(keys)[0]
+        )
+
+        resolved, success = NaturalKeyChild.objects.resolve_keys(
+            keys, auto_create=True, bulk=True
+        )
+        self.assertTrue(success)
+        self.assertEqual(
+            resolved[("code3", "group3", "mode1")].parent.code, "code3"
+        )
+        self.assertEqual(NaturalKeyChild.objects.count(), 6)
+
+    def test_resolve_keys_bulk_conversion(self):
+        obj = ModelWithExtraField.objects.find(
+            "extra1",
+            "2019-07-26",
+            defaults={"extra": "Test 123"},
+        )
+        resolved, success = ModelWithExtraField.objects.resolve_keys(
+            [("extra1", "2019-07-26"), ("extra1", "2019-07-27")],
+            bulk=True,
+        )
+        self.assertFalse(success)
+        self.assertEqual(resolved[("extra1", "2019-07-26")], obj)
+        self.assertIsNone(resolved[("extra1", "2019-07-27")])
+
+    @override_settings(USE_TZ=True)
+    def test_resolve_keys_bulk_datetime(self):
+        obj = ModelWithDateTime.objects.create(
+            code="a", timestamp=timezone.make_aware(datetime(2020, 1, 1))
+        )
+        keys = [("a", "2020-01-01 00:00:00"), ("a", datetime(2020, 1, 1))]
+        resolved, success = ModelWithDateTime.objects.resolve_keys(
+            keys, bulk=True
+        )
+        self.assertTrue(success)
+        self.assertEqual(resolved, {keys[0]: obj, keys[1]: obj})
+        self.assertEqual(
+            ModelWithDateTime.objects.bulk_get_or_create_by_natural_key(keys),
+            {keys[0]: obj, keys[1]: obj},
+        )
+        self.assertEqual(ModelWithDateTime.objects.count(), 1)
+        self.assertEqual(
+            ModelWithDateTime.objects.natural_key_pks(keys),
+            {keys[0]: obj.pk, keys[1]: obj.pk},
+        )
+
+    def test_resolve_keys_bulk_chunked(self):
+        keys = [("code%s" % i,) for i in range(1200)]
+        for key in keys[::2]:
+            ModelWithSingleUniqueField.objects.create(code=key[0])
+        with self.assertNumQueries(2):
+            resolved, success = (
+                ModelWithSingleUniqueField.objects.resolve_keys(
+                    keys, bulk=True
+                )
+            )
+        self.assertFalse(success)
+        self.assertEqual(
+            [key for key, obj in resolved.items() if obj], keys[::2]
+        )
+
+    def test_bulk_get_or_create(self):
+        p1 = NaturalKeyParent.objects.find("code1", "group1")
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        keys = [
+            ("code1", "group1", "mode1"),
+            ("code1", "group1", "mode2"),
+            ("code2", "group2", "mode1"),
+            ("code2", "group2", "mode2"),
+            (None, None, "mode0"),
+        ]
+
+        # Fetch existing parents and children, create missing parents
+        # (refetching existing ones), then create missing children
+        with self.assertNumQueries(5):
+            result = NaturalKeyChild.objects.bulk_get_or_create_by_natural_key(
+                keys
+            )
+        self.assertEqual(list(result), keys)
+        self.assertEqual(result[keys[0]], c1)
+        self.assertEqual(result[keys[1]].parent, p1)
+        self.assertEqual(result[keys[2]].parent, result[keys[3]].parent)
+        self.assertIsNone(result[keys[4]].parent)
+        self.assertEqual(NaturalKeyParent.objects.count(), 2)
+        self.assertEqual(NaturalKeyChild.objects.count(), 5)
+        for key, obj in result.items():
+            self.assertIsNotNone(obj.pk)
+            self.assertEqual(
+                NaturalKeyChild.objects.get_by_natural_key(*key), obj
+            )
+
+        # Repeating should not create anything
+        with self.assertNumQueries(2):
+            again = NaturalKeyChild.objects.bulk_get_or_create_by_natural_key(
+                keys
+            )
+        self.assertEqual(again, result)
+
+    def test_bulk_get_or_create_with_defaults(self):
+        result = ModelWithExtraField.objects.bulk_get_or_create_by_natural_key(
+            [("extra1", "2019-07-26"), ("extra1", date(2019, 7, 26))],
+            defaults={("extra1", "2019-07-26"): {"extra": "Test 123"}},
+        )
+        self.assertEqual(ModelWithExtraField.objects.count(), 1)
+        obj = ModelWithExtraField.objects.get()
+        self.assertEqual(obj.extra, "Test 123")
+        self.assertEqual(result[("extra1", date(2019, 7, 26))], obj)
+
+    def test_bulk_get_or_create_inherited(self):
+        # bulk_create() doesn't support multi-table inheritance, so missing
+        # objects are created one at a time
+        manager = ModelWithInheritedKey.objects
+        obj1 = manager.find("code1")
+        result = manager.bulk_get_or_create_by_natural_key(
+            [("code1",), ("code2",), ("code3",)],
+            defaults={("code2",): {"extra": "Test"}},
+        )
+        self.assertEqual(result[("code1",)], obj1)
+        self.assertEqual(result[("code2",)].extra, "Test")
+        self.assertEqual(manager.count(), 3)
+
+        resolved, success = manager.resolve_keys(
+            [("code3",), ("code4",)], auto_create=True, bulk=True
+        )
+        self.assertEqual(resolved[("code3",)], result[("code3",)])
+        self.assertEqual(manager.count(), 4)
+
+        result = manager.bulk_update_or_create_by_natural_key(
+            {("code1",): {"extra": "Updated"}, ("code5",): {"extra": "New"}}
+        )
+        self.assertEqual(result, (1, 1, 0))
+        self.assertEqual(
+            dict(manager.values_list("code", "extra")),
+            {
+                "code1": "Updated",
+                "code2": "Test",
+                "code3": "",
+                "code4": "",
+                "code5": "New",
+            },
+        )
+
+    def test_natural_key_metadata_cache(self):
+        fields = NaturalKeyChild.get_natural_key_fields()
+        self.assertIs(NaturalKeyChild.get_natural_key_fields(), fields)
+        self.assertEqual(
+            NaturalKeyChild.get_natural_key_paths(),
+            {
+                "parent__code": ("parent", "code"),
+                "parent__group": ("parent", "group"),
+                "mode": ("mode",),
+            },
+        )
+
+        # Setting _natural_key late should invalidate dependent metadata
+        NaturalKeyParent._natural_key = ("code",)
+        try:
+            self.assertEqual(
+                NaturalKeyParent.get_natural_key_fields(), ("code",)
+            )
+            self.assertEqual(
+                NaturalKeyChild.get_natural_key_fields(),
+                ("parent__code", "mode"),
+            )
+        finally:
+            del NaturalKeyParent._natural_key
+        self.assertEqual(NaturalKeyChild.get_natural_key_fields(), fields)
+
+    def test_join_nested_keys(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c0 = NaturalKeyChild.objects.create(mode="mode0")
+        manager = NaturalKeyChild.objects
+        manager.join_nested_keys = True
+        try:
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    manager.get_by_natural_key("code1", "group1", "mode1"),
+                    c1,
+                )
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    manager.get_by_natural_key(None, None, "mode0"), c0
+                )
+            with self.assertRaises(NaturalKeyChild.DoesNotExist):
+                manager.get_by_natural_key("code1", "group2", "mode1")
+
+            # Fall back to separate queries if get_by_natural_key is
+            # overridden on a related manager
+            class ParentManager(NaturalKeyModelManager):
+                def get_by_natural_key(self, code, group):
+                    return super().get_by_natural_key(code.lower(), group)
+
+            parent_manager = ParentManager()
+            parent_manager.model = NaturalKeyParent
+            with mock.patch.object(
+                NaturalKeyParent, "objects", parent_manager
+            ):
+                with self.assertNumQueries(2):
+                    self.assertEqual(
+                        manager.get_by_natural_key("CODE1", "group1", "mode1"),
+                        c1,
+                    )
+        finally:
+            manager.join_nested_keys = False
+
+    def test_with_natural_keys(self):
+        for i in range(3):
+            NaturalKeyChild.objects.find("code%s" % i, "group1", "mode1")
+        NaturalKeyChild.objects.create(mode="mode0")
+        with self.assertNumQueries(1):
+            slugs = [
+                obj.natural_key_slug
+                for obj in NaturalKeyChild.objects.with_natural_keys()
+            ]
+        self.assertEqual(
+            slugs,
+            [
+                "code0-group1-mode1",
+                "code1-group1-mode1",
+                "code2-group1-mode1",
+                "None-None-mode0",
+            ],
+        )
+        with self.assertNumQueries(1):
+            list(
+                NaturalKeyParent.objects.filter(
+                    group="group1"
+                ).with_natural_keys()
+            )
+
+    def test_natural_keys_iterator(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.create(mode="mode0")
+        queryset = NaturalKeyChild.objects.order_by("pk")
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(queryset.natural_keys()),
+                [c1.natural_key(), c2.natural_key()],
+            )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(queryset.natural_key_slugs()),
+                [c1.natural_key_slug, c2.natural_key_slug],
+            )
+
+        obj = ModelWithExtraField.objects.find(
+            "extra1", "2019-07-26", defaults={"extra": "Test 123"}
+        )
+        self.assertEqual(
+            list(ModelWithExtraField.objects.natural_key_slugs()),
+            [obj.natural_key_slug],
+        )
+
+    def test_filter_natural_key_in(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.find("code1", "group1", "mode2-alt")
+        c3 = NaturalKeyChild.objects.find("code2", "group1", "mode1")
+        c4 = NaturalKeyChild.objects.create(mode="mode0")
+        NaturalKeyChild.objects.find("code2", "group2", "mode2")
+
+        self.assertEqual(
+            set(
+                NaturalKeyChild.objects.filter(
+                    natural_key_slug__in=[
+                        "code1-group1-mode1",
+                        "code1-group1-mode2-alt",
+                        "code2-group1-mode1",
+                        "code2-group1-mode3",
+                        "invalid",
+                    ]
+                )
+            ),
+            {c1, c2, c3},
+        )
+        self.assertEqual(
+            set(
+                NaturalKeyChild.objects.filter(
+                    natural_key__in=[
+                        ("code1", "group1", "mode1"),
+                        ("code2", "group1", "mode1"),
+                        (None, None, "mode0"),
+                    ]
+                )
+            ),
+            {c1, c3, c4},
+        )
+        self.assertFalse(
+            NaturalKeyChild.objects.filter(natural_key_slug__in=[]).exists()
+        )
+        with self.assertRaises(TypeError):
+            NaturalKeyChild.objects.filter(natural_key__in=[("code1",)])
+
+        keys = [("code%s" % i,) for i in range(1200)]
+        for key in keys[::2]:
+            ModelWithSingleUniqueField.objects.create(code=key[0])
+        self.assertEqual(
+            ModelWithSingleUniqueField.objects.filter(
+                natural_key__in=keys
+            ).count(),
+            600,
+        )
+
+    def test_filter_natural_key_in_large(self):
+        # Large filters should not exceed SQLite's expression depth limit,
+        # both for row values and for keys with nulls (which can't use them)
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.create(mode="mode1")
+        slugs = ["code%s-group%s-mode1" % (i, i) for i in range(1, 2000)]
+        keys = [(None, None, "mode%s" % i) for i in range(1, 2000)]
+        keys += [(None, "group%s" % i, "mode1") for i in range(1, 2000)]
+        self.assertEqual(
+            list(NaturalKeyChild.objects.filter(natural_key_slug__in=slugs)),
+            [c1],
+        )
+        self.assertEqual(
+            list(NaturalKeyChild.objects.filter(natural_key__in=keys)),
+            [c2],
+        )
+
+    def test_natural_key_slug_annotation(self):
+        NaturalKeyChild.objects.find("code2", "group1", "mode1")
+        NaturalKeyChild.objects.find("code1", "group1", "mode2")
+        NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        NaturalKeyChild.objects.create(mode="mode0")
+
+        queryset = NaturalKeyChild.objects.with_natural_key_slug()
+        self.assertEqual(
+            list(
+                queryset.order_by("natural_key_slug").values_list(
+                    "natural_key_slug", flat=True
+                )
+            ),
+            [
+                "None-None-mode0",
+                "code1-group1-mode1",
+                "code1-group1-mode2",
+                "code2-group1-mode1",
+            ],
+        )
+        self.assertEqual(
+            [
+                obj.natural_key_slug
+                for obj in queryset.filter(
+                    natural_key_slug__startswith="code1-"
+                ).order_by("natural_key_slug")
+            ],
+            ["code1-group1-mode1", "code1-group1-mode2"],
+        )
+
+        obj = ModelWithExtraField.objects.find(
+            "extra1", "2019-07-26", defaults={"extra": "Test 123"}
+        )
+        self.assertEqual(
+            ModelWithExtraField.objects.with_natural_key_slug()
+            .get(natural_key_slug__gte="extra1-2019")
+            .natural_key_slug,
+            obj.natural_key_slug,
+        )
+
+    def test_natural_key_slug_index(self):
+        index = NaturalKeyParent.get_natural_key_slug_index("parent_slug_idx")
+        self.assertEqual(index.name, "parent_slug_idx")
+        editor = connection.schema_editor(collect_sql=True)
+        sql = str(index.create_sql(NaturalKeyParent, editor))
+        self.assertIn('CAST("code" AS text)', sql)
+        self.assertIn(" || ", sql)
+        self.assertNotIn("CONCAT", sql.upper())
+        with self.assertRaises(NotImplementedError):
+            NaturalKeyChild.get_natural_key_slug_index("child_slug_idx")
+        with self.assertRaises(NotImplementedError):
+            ModelWithExtraField.get_natural_key_slug_index("extra_slug_idx")
+
+    async def test_async_api(self):
+        manager = NaturalKeyChild.objects
+        with self.assertRaises(NaturalKeyChild.DoesNotExist):
+            await manager.aget_by_natural_key("code1", "group1", "mode1")
+
+        child, created = await manager.aget_or_create_by_natural_key(
+            "code1", "group1", "mode1"
+        )
+        self.assertTrue(created)
+        self.assertEqual(child.parent.code, "code1")
+        self.assertEqual(
+            await manager.afind("code1", "group1", "mode1"), child
+        )
+        self.assertEqual(
+            await manager.aget_by_natural_key("code1", "group1", "mode1"),
+            child,
+        )
+        self.assertEqual(
+            await manager.acreate_by_natural_key(None, None, "mode2"),
+            await manager.aget_by_natural_key(None, None, "mode2"),
+        )
+        obj = await ModelWithExtraField.objects.afind(
+            "extra1", "2019-07-26", defaults={"extra": "Test"}
+        )
+        self.assertEqual(obj.extra, "Test")
+
+        keys = [("code1", "group1", "mode1"), ("code2", "group1", "mode1")]
+        resolved, success = await manager.aresolve_keys(keys)
+        self.assertFalse(success)
+        self.assertEqual(resolved, {keys[0]: child, keys[1]: None})
+        resolved, success = await manager.aresolve_keys(keys, bulk=True)
+        self.assertEqual(resolved, {keys[0]: child, keys[1]: None})
+        resolved, success = await manager.aresolve_keys(keys, auto_create=True)
+        self.assertTrue(success)
+        self.assertEqual(resolved[keys[0]], child)
+        self.assertEqual(resolved[keys[1]].parent.code, "code2")
+        self.assertEqual(await NaturalKeyParent.objects.acount(), 2)
+
+    async def test_async_cache(self):
+        parent = await NaturalKeyParent.objects.acreate(
+            code="code1", group="group1"
+        )
+        child = await NaturalKeyChild.objects.acreate(
+            parent=parent, mode="mode1"
+        )
+        with cache_natural_keys() as cache:
+            for i in range(3):
+                self.assertEqual(
+                    await NaturalKeyChild.objects.aget_by_natural_key(
+                        "code1", "group1", "mode1"
+                    ),
+                    child,
+                )
+        self.assertEqual(cache.cache_info().hits, 2)
+        self.assertEqual(cache.cache_info().misses, 2)
+
+    def test_get_or_create_race(self):
+        child = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        parent = child.parent
+        manager = NaturalKeyChild.objects
+
+        def created_concurrently(manager):
+            # Simulate another process creating the object after the lookup
+            real_get = manager._get_by_natural_key
+            calls = []
+
+            def get(*args):
+                calls.append(args)
+                if len(calls) == 1:
+                    raise manager.model.DoesNotExist()
+                return real_get(*args)
+
+            return mock.patch.object(manager, "_get_by_natural_key", get)
+
+        with created_concurrently(manager):
+            self.assertEqual(
+                manager.get_or_create_by_natural_key(
+                    "code1", "group1", "mode1"
+                ),
+                (child, False),
+            )
+
+        # Also applies to related objects
+        with created_concurrently(NaturalKeyParent.objects):
+            obj, created = manager.get_or_create_by_natural_key(
+                "code1", "group1", "mode2"
+            )
+        self.assertTrue(created)
+        self.assertEqual(obj.parent, parent)
+        self.assertEqual(NaturalKeyParent.objects.count(), 1)
+
+        # Other integrity errors are still raised
+        with mock.patch.object(manager, "create", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                manager.get_or_create_by_natural_key(
+                    "code1", "group1", "mode3"
+                )
+
+    def test_bulk_get_or_create_ignore_conflicts(self):
+        existing = NaturalKeyParent.objects.find("code1", "group1")
+        keys = [("code1", "group1"), ("code2", "group1")]
+        manager = NaturalKeyParent.objects
+        real_fetch = manager._fetch_by_natural_keys
+        calls = []
+
+        def fetch(keys):
+            # Simulate another process creating code1 after the lookup
+            calls.append(keys)
+            if len(calls) == 1:
+                return {}
+            return real_fetch(keys)
+
+        with mock.patch.object(manager, "_fetch_by_natural_keys", fetch):
+            objs = manager.bulk_get_or_create_by_natural_key(
+                keys, ignore_conflicts=True
+            )
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(objs[keys[0]], existing)
+        self.assertEqual(objs[keys[1]].natural_key(), keys[1])
+        self.assertEqual(NaturalKeyParent.objects.count(), 2)
+
+    def test_bulk_update_or_create(self):
+        manager = ModelWithExtraField.objects
+        manager.find("code1", "2019-07-26", defaults={"extra": "old"})
+        manager.find("code2", "2019-07-26", defaults={"extra": "same"})
+        for supports_upsert in True, False:
+            records = {
+                ("code1", "2019-07-26"): {"extra": str(supports_upsert)},
+                ("code2", "2019-07-26"): {"extra": "same"},
+                ("code3", "2019-07-26"): {"extra": "new"},
+            }
+            manager.filter(code="code3").delete()
+            with mock.patch.object(
+                connection.features,
+                "supports_update_conflicts_with_target",
+                supports_upsert,
+            ):
+                # Fetch, insert, update
+                with self.assertNumQueries(3):
+                    result = manager.bulk_update_or_create_by_natural_key(
+                        records
+                    )
+            self.assertEqual(result, (1, 1, 1))
+            self.assertEqual(result.inserted, 1)
+            self.assertEqual(
+                dict(manager.values_list("code", "extra")),
+                {
+                    "code1": str(supports_upsert),
+                    "code2": "same",
+                    "code3": "new",
+                },
+            )
+
+        # Nested keys
+        result = NaturalKeyChild.objects.bulk_update_or_create_by_natural_key(
+            {
+                ("code1", "group1", "mode1"): {},
+                ("code1", "group1", "mode2"): {},
+            }
+        )
+        self.assertEqual(result, (2, 0, 0))
+        self.assertEqual(NaturalKeyParent.objects.count(), 1)
+
+    def test_bulk_update_or_create_invalidates_cache(self):
+        manager = ModelWithExtraField.objects
+        manager.find("code1", "2019-07-26", defaults={"extra": "old"})
+        with cache_natural_keys():
+            self.assertEqual(
+                manager.get_by_natural_key("code1", "2019-07-26").extra, "old"
+            )
+            manager.bulk_update_or_create_by_natural_key(
+                {("code1", "2019-07-26"): {"extra": "new"}}
+            )
+            self.assertEqual(
+                manager.get_by_natural_key("code1", "2019-07-26").extra, "new"
+            )
+
+    def test_natural_key_slug_codec(self):
+        obj = ModelWithExtraField.objects.find("extra-1", "2019-07-26")
+        codec = ModelWithExtraField.get_natural_key_slug_codec()
+        self.assertIs(codec, ModelWithExtraField.get_natural_key_slug_codec())
+        self.assertEqual(codec.encode(obj.natural_key()), obj.natural_key_slug)
+
+        # Values are converted to the natural key field types
+        self.assertEqual(
+            codec.decode("extra1-2019-07-26"), ["extra1", date(2019, 7, 26)]
+        )
+        self.assertIsNone(codec.decode("extra1-2019-13-26"))
+        self.assertIsNone(codec.decode("extra1"))
+        with self.assertNumQueries(0):
+            self.assertFalse(
+                ModelWithExtraField.objects.filter(
+                    natural_key_slug="extra1-2019-13-26"
+                ).exists()
+            )
+
+        # Separators within values are ambiguous without escaping
+        self.assertEqual(obj.natural_key_slug, "extra-1-2019-07-26")
+        self.assertFalse(
+            ModelWithExtraField.objects.filter(
+                natural_key_slug=obj.natural_key_slug
+            ).exists()
+        )
+
+        with mock.patch.object(
+            ModelWithExtraField, "natural_key_slug_escape", "~"
+        ):
+            clear_natural_key_cache()
+            self.assertEqual(obj.natural_key_slug, "extra~-1-2019~-07~-26")
+            self.assertEqual(
+                ModelWithExtraField.objects.get(
+                    natural_key_slug=obj.natural_key_slug
+                ),
+                obj,
+            )
+            self.assertEqual(
+                ModelWithExtraField.objects.with_natural_key_slug()
+                .values_list("natural_key_slug", flat=True)
+                .get(pk=obj.pk),
+                obj.natural_key_slug,
+            )
+            codec = ModelWithExtraField.get_natural_key_slug_codec()
+            self.assertEqual(
+                codec.decode(codec.encode(["a~-~~b", "2019-07-26"])),
+                ["a~-~~b", date(2019, 7, 26)],
+            )
+        clear_natural_key_cache()
+
+        # Related natural key fields are converted too
+        child = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        self.assertEqual(
+            NaturalKeyChild.objects.get(natural_key_slug="code1-group1-mode1"),
+            child,
+        )
+
+    def test_filter_natural_keys(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.find("code2", "group1", "mode1")
+        c3 = NaturalKeyChild.objects.create(mode="mode1")
+        NaturalKeyChild.objects.find("code1", "group1", "mode2")
+        keys = [
+            ("code1", "group1", "mode1"),
+            ("code2", "group1", "mode1"),
+            ("code3", "group1", "mode1"),
+            (None, None, "mode1"),
+        ]
+        queryset = NaturalKeyChild.objects.filter_natural_keys(keys)
+        self.assertIn(" IN (VALUES ", str(queryset.query))
+        self.assertEqual(set(queryset), {c1, c2, c3})
+
+        with mock.patch(
+            "natural_keys.models.supports_row_values", return_value=False
+        ):
+            queryset = NaturalKeyChild.objects.filter_natural_keys(keys)
+            self.assertNotIn(" IN (VALUES ", str(queryset.query))
+            self.assertEqual(set(queryset), {c1, c2, c3})
+
+        # Values are converted for the database
+        obj = ModelWithExtraField.objects.find("extra1", "2019-07-26")
+        self.assertEqual(
+            list(
+                ModelWithExtraField.objects.filter_natural_keys(
+                    [("extra1", "2019-07-26"), ("extra1", date(2019, 7, 27))]
+                )
+            ),
+            [obj],
+        )
+        self.assertFalse(
+            ModelWithExtraField.objects.filter_natural_keys([]).exists()
+        )
+
+    def test_natural_key_pks(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.create(mode="mode1")
+        keys = [
+            ("code1", "group1", "mode1"),
+            ["code1", "group1", "mode1"],
+            (None, None, "mode1"),
+            ("code2", "group1", "mode1"),
+        ]
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                NaturalKeyChild.objects.natural_key_pks(iter(keys)),
+                {keys[0]: c1.pk, keys[2]: c2.pk},
+            )
+        self.assertEqual(
+            NaturalKeyChild.objects.missing_natural_keys(keys), {keys[3]}
+        )
+        self.assertEqual(
+            NaturalKeyChild.objects.filter(
+                parent__isnull=False
+            ).missing_natural_keys(keys),
+            {keys[2], keys[3]},
+        )
+        with self.assertRaises(TypeError):
+            NaturalKeyChild.objects.natural_key_pks([("code1", "mode1")])
+
+        # Values are converted, and invalid keys are missing without a query
+        obj = ModelWithExtraField.objects.find("extra1", "2019-07-26")
+        keys = [
+            ("extra1", "2019-07-26"),
+            ("extra1", date(2019, 7, 26)),
+            ("extra1", "2019-07-32"),
+        ]
+        self.assertEqual(
+            ModelWithExtraField.objects.natural_key_pks(keys),
+            {keys[0]: obj.pk, keys[1]: obj.pk},
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ModelWithExtraField.objects.missing_natural_keys(keys[2:]),
+                {keys[2]},
+            )
+
+    def test_natural_key_map(self):
+        c1 = NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        c2 = NaturalKeyChild.objects.find("code1", "group1", "mode2")
+        c3 = NaturalKeyChild.objects.create(mode="mode1")
+        expected = {
+            ("code1", "group1", "mode1"): c1.pk,
+            ("code1", "group1", "mode2"): c2.pk,
+            (None, None, "mode1"): c3.pk,
+        }
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                NaturalKeyChild.objects.natural_key_map(), expected
+            )
+        with self.assertNumQueries(1):
+            keys = NaturalKeyChild.objects.natural_key_map(intern=True)
+        self.assertEqual(keys, expected)
+        key1, key2 = sorted(key for key in keys if key[0])
+        self.assertIs(key1[0], key2[0])
+        self.assertEqual(
+            NaturalKeyChild.objects.filter(mode="mode2").natural_key_map(),
+            {("code1", "group1", "mode2"): c2.pk},
+        )
+
+    def test_natural_key_map_intern_types(self):
+        # Equal values of different types should not be merged
+        rows = [
+            (1, True, "group1", "mode1"),
+            (2, 1, "group2", "mode1"),
+            (3, Decimal("1"), "group3", "mode1"),
+        ]
+        with mock.patch.object(NaturalKeyQuerySet, "values_list") as values:
+            values.return_value.iterator.return_value = iter(rows)
+            keys = NaturalKeyChild.objects.natural_key_map(intern=True)
+        self.assertEqual(
+            {pk: type(key[0]) for key, pk in keys.items()},
+            {1: bool, 2: int, 3: Decimal},
+        )
+
+    def test_natural_key_pks_chunked(self):
+        for i in range(10):
+            ModelWithExtraField.objects.find("extra%s" % i, "2019-07-26")
+        keys = [("extra%s" % i, "2019-07-26") for i in range(12)]
+        with mock.patch.object(connection.features, "max_query_params", 8):
+            with self.assertNumQueries(3):
+                missing = ModelWithExtraField.objects.missing_natural_keys(
+                    keys
+                )
+        self.assertEqual(missing, set(keys[10:]))
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 
 try:
     from rest_framework.test import APITestCase
@@ -6,12 +7,26 @@ except ImportError:
     raise unittest.SkipTest("Skipping DRF tests as DRF is not installed.")
 
 from rest_framework import status
+from django.test import override_settings
+from django.core.cache import cache
 from tests.test_app.models import (
+    NaturalKeyParent,
     NaturalKeyChild,
     ModelWithNaturalKey,
     ModelWithSingleUniqueField,
+    ModelWithInheritedKey,
+    ModelWithInheritedNaturalKey,
 )
-from natural_keys import NaturalKeySerializer
+from natural_keys import (
+    NaturalKeySerializer,
+    NaturalKeyModelSerializer,
+    track_natural_keys,
+)
+from natural_keys.serializers import (
+    NaturalKeyListSerializer,
+    NaturalKeyValidator,
+)
+from natural_keys.cache import get_cached_pks
 
 # Tests for natural key DRF integration
 
@@ -236,3 +251,366 @@ class NaturalKeyRestTestCase(APITestCase):
             status.HTTP_404_NOT_FOUND,
             response.status_code,
         )
+
+    @override_settings(NATURAL_KEYS_CACHE="default")
+    def test_naturalkey_rest_shared_cache(self):
+        cache.clear()
+        form = {
+            "mode": "mode3d",
+            "parent[code]": "code3",
+            "parent[group]": "group3",
+        }
+        response = self.client.post("/naturalkeychilds.json", form)
+        self.assertEqual(
+            response.status_code, status.HTTP_201_CREATED, response.data
+        )
+
+        # Nested parent pk is resolved from the cache during validation
+        response = self.client.post("/naturalkeychilds.json", form)
+        self.assertEqual(
+            response.status_code, status.HTTP_400_BAD_REQUEST, response.data
+        )
+        parent = NaturalKeyChild.objects.get(mode="mode3d").parent
+        self.assertEqual(
+            get_cached_pks(NaturalKeyParent, "default", [("code3", "group3")]),
+            {("code3", "group3"): parent.pk},
+        )
+
+    def test_naturalkey_rest_bulk_create(self):
+        serializer_class = NaturalKeyModelSerializer.for_model(
+            ModelWithNaturalKey,
+            include_fields="__all__",
+        )
+        data = [
+            {
+                "key": {
+                    "mode": "mode%s" % (i % 2),
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+                "value": i,
+            }
+            for i in range(6)
+        ]
+        serializer = serializer_class(data=data, many=True)
+        self.assertIsInstance(serializer, NaturalKeyListSerializer)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        # Resolve all nested keys at once, create missing nested objects via
+        # find(), then create each item via create()
+        with mock.patch.object(
+            serializer_class,
+            "create",
+            side_effect=serializer_class.create,
+            autospec=True,
+        ) as create:
+            with self.assertNumQueries(21):
+                instances = serializer.save()
+        self.assertEqual(create.call_count, 6)
+        self.assertEqual(len(instances), 6)
+        self.assertEqual(NaturalKeyChild.objects.count(), 2)
+        self.assertEqual(ModelWithNaturalKey.objects.count(), 6)
+
+        # With Meta.bulk_create, items are created with bulk_create()
+        class BulkSerializer(serializer_class):
+            class Meta(serializer_class.Meta):
+                bulk_create = True
+
+        ModelWithNaturalKey.objects.all().delete()
+        serializer = BulkSerializer(data=data, many=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertNumQueries(3):
+            instances = serializer.save()
+        self.assertEqual(ModelWithNaturalKey.objects.count(), 6)
+        self.assertEqual(
+            serializer.data[5],
+            {
+                "id": instances[5].pk,
+                "key": {
+                    "mode": "mode1",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+                "value": "5",
+            },
+        )
+
+        # Top-level NaturalKeySerializer uses bulk_get_or_create
+        serializer = NaturalKeySerializer.for_model(NaturalKeyChild)(
+            data=[
+                {
+                    "mode": "mode2",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+                {
+                    "mode": "mode3",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+            ],
+            many=True,
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        instances = serializer.save()
+        self.assertEqual(
+            [instance.natural_key() for instance in instances],
+            [("code1", "group1", "mode2"), ("code1", "group1", "mode3")],
+        )
+
+    def test_naturalkey_rest_bulk_create_override(self):
+        class Serializer(
+            NaturalKeyModelSerializer.for_model(
+                ModelWithNaturalKey, include_fields="__all__"
+            )
+        ):
+            class Meta(NaturalKeyModelSerializer.Meta):
+                model = ModelWithNaturalKey
+                fields = "__all__"
+                bulk_create = True
+
+            def create(self, validated_data):
+                validated_data["value"] = "custom"
+                return super(Serializer, self).create(validated_data)
+
+        serializer = Serializer(
+            data=[
+                {
+                    "key": {
+                        "mode": "mode1",
+                        "parent": {"code": "code1", "group": "group1"},
+                    },
+                    "value": i,
+                }
+                for i in range(2)
+            ],
+            many=True,
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        instances = serializer.save()
+        self.assertEqual(
+            [instance.value for instance in instances], ["custom", "custom"]
+        )
+        self.assertEqual(instances[0].key, instances[1].key)
+
+    def test_naturalkey_rest_bulk_create_inherited(self):
+        # Nested objects with multi-table inheritance can't be created with
+        # bulk_create(), even if Meta.bulk_create is set
+        serializer_class = NaturalKeyModelSerializer.for_model(
+            ModelWithInheritedNaturalKey, include_fields="__all__"
+        )
+
+        class BulkSerializer(serializer_class):
+            class Meta(serializer_class.Meta):
+                bulk_create = True
+
+        data = [{"key": {"code": "code%s" % i}, "value": i} for i in range(2)]
+        manager = ModelWithInheritedKey.objects
+        for serializer_class in serializer_class, BulkSerializer:
+            manager.all().delete()
+            serializer = serializer_class(data=data, many=True)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            with mock.patch.object(
+                manager, "find", side_effect=manager.find
+            ) as find:
+                instances = serializer.save()
+            self.assertEqual(find.call_count, 2)
+            self.assertEqual(
+                [instance.key.code for instance in instances],
+                ["code0", "code1"],
+            )
+            self.assertEqual(ModelWithInheritedKey.objects.count(), 2)
+
+    def test_naturalkey_rest_bulk_validate(self):
+        NaturalKeyChild.objects.find("code1", "group1", "mode1")
+        serializer = NaturalKeySerializer.for_model(NaturalKeyChild)(
+            data=[
+                {
+                    "mode": "mode1",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+                {
+                    "mode": "mode2",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+                {
+                    "mode": "mode1",
+                    "parent": {"code": "code2", "group": "group2"},
+                },
+                {
+                    "mode": "mode2",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+            ],
+            many=True,
+        )
+
+        # One query for the nested keys, one for uniqueness
+        with self.assertNumQueries(2):
+            self.assertFalse(serializer.is_valid())
+        message = "The fields parent, mode must make a unique set."
+        self.assertEqual(
+            serializer.errors,
+            [
+                {"non_field_errors": [message]},
+                {},
+                {},
+                {"non_field_errors": [message]},
+            ],
+        )
+
+        serializer = NaturalKeySerializer.for_model(NaturalKeyChild)(
+            data=serializer.initial_data[1:3],
+            many=True,
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_naturalkey_rest_bulk_validate_source(self):
+        NaturalKeyChild.objects.find("code1", "group1", "mode1")
+
+        class Serializer(NaturalKeySerializer):
+            owner = NaturalKeySerializer.for_model(
+                NaturalKeyParent, validate_key=False
+            )(source="parent")
+
+            class Meta(NaturalKeySerializer.Meta):
+                model = NaturalKeyChild
+                fields = ["owner", "mode"]
+                validators = [
+                    NaturalKeyValidator(
+                        queryset=NaturalKeyChild.objects,
+                        fields=["owner", "mode"],
+                    )
+                ]
+
+        serializer = Serializer(
+            data=[
+                {"owner": {"code": "code1", "group": "group1"}, "mode": mode}
+                for mode in ("mode1", "mode2")
+            ],
+            many=True,
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors,
+            [
+                {
+                    "non_field_errors": [
+                        "The fields owner, mode must make a unique set."
+                    ]
+                },
+                {},
+            ],
+        )
+
+    def test_naturalkey_rest_serializer_cache(self):
+        serializer_class = NaturalKeySerializer.for_model(NaturalKeyChild)
+        self.assertIs(
+            NaturalKeySerializer.for_model(NaturalKeyChild), serializer_class
+        )
+        self.assertIsNot(
+            NaturalKeySerializer.for_model(
+                NaturalKeyChild, validate_key=False
+            ),
+            serializer_class,
+        )
+        self.assertIs(
+            NaturalKeyModelSerializer.for_model(
+                ModelWithNaturalKey, include_fields=["key", "value"]
+            ),
+            NaturalKeyModelSerializer.for_model(
+                ModelWithNaturalKey, include_fields=("key", "value")
+            ),
+        )
+
+        # Fields are only built once per class
+        str(serializer_class())
+        with mock.patch(
+            "rest_framework.utils.model_meta.get_field_info"
+        ) as get_field_info:
+            fields = serializer_class().fields
+            fields["parent"].fields
+        get_field_info.assert_not_called()
+        self.assertTrue(fields["parent"].fields["code"].required)
+
+    def test_naturalkey_rest_convert_plan(self):
+        serializer_class = NaturalKeyModelSerializer.for_model(
+            ModelWithNaturalKey,
+            include_fields="__all__",
+        )
+        serializer = serializer_class(
+            data={
+                "key": {
+                    "mode": "mode1",
+                    "parent": {"code": "code1", "group": "group1"},
+                },
+                "value": 1,
+            }
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(
+            [
+                (name, field.Meta.model)
+                for name, field in serializer.get_natural_key_plan()
+            ],
+            [("key", NaturalKeyChild)],
+        )
+
+        # create() should not need to rebuild the fields
+        with mock.patch.object(
+            serializer_class, "get_fields", side_effect=AssertionError
+        ):
+            instance = serializer.save()
+        self.assertEqual(
+            instance.key.natural_key(), ("code1", "group1", "mode1")
+        )
+
+    def test_naturalkey_rest_convert_plan_per_instance(self):
+        class Serializer(NaturalKeyModelSerializer):
+            def __init__(self, *args, **kwargs):
+                super(Serializer, self).__init__(*args, **kwargs)
+                if self.context.get("without_key"):
+                    self.fields.pop("key")
+
+            class Meta:
+                model = ModelWithNaturalKey
+                fields = "__all__"
+
+        data = {
+            "key": {
+                "mode": "mode1",
+                "parent": {"code": "code1", "group": "group1"},
+            },
+            "value": 1,
+        }
+        serializer = Serializer(data=data, context={"without_key": True})
+        self.assertEqual(serializer.get_natural_key_plan(), [])
+
+        # The plan is filtered per instance, and the nested create() is used
+        child_class = NaturalKeySerializer.for_model(
+            NaturalKeyChild, validate_key=False
+        )
+        for many in (False, True):
+            serializer = Serializer(data=[data] if many else data, many=many)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            with mock.patch.object(
+                child_class,
+                "create",
+                side_effect=child_class.create,
+                autospec=True,
+            ) as create:
+                serializer.save()
+            self.assertEqual(create.call_count, 1)
+        self.assertEqual(ModelWithNaturalKey.objects.count(), 2)
+
+    def test_naturalkey_rest_instrumentation(self):
+        with track_natural_keys() as tracker:
+            response = self.client.post(
+                "/naturalkeychilds.json",
+                {"mode": "mode1", "parent": {"code": "code1", "group": "g"}},
+                format="json",
+            )
+        self.assertEqual(
+            response.status_code, status.HTTP_201_CREATED, response.data
+        )
+        stats = tracker.summary()[
+            ("test_app.NaturalKeyChild", "serializer_create")
+        ]
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.max_depth, 0)